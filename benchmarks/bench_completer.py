@@ -0,0 +1,88 @@
+"""
+bench_completer.py
+
+benchmark of clio.create_completer on synthetic behavior names (apps of 50
+behaviors, e.g. app-0042-4313f4/behavior_7) against the completer it replaced,
+which rescanned every name for each state readline asked for. A Tab press is
+simulated the way readline does it: state 0, 1, 2... until None.
+
+Exits non-zero when the completers disagree or the indexed one is not at least
+MIN_SPEEDUP times faster.
+
+usage: python benchmarks/bench_completer.py [--names 50000]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import clio
+
+BEHAVIORS_PER_APP = 50
+MIN_SPEEDUP = 10
+
+
+def scanning_completer(completions):
+    """create_completer as it was: a full scan for every state."""
+    def completer(text, state):
+        options = [i for i in completions if i.startswith(text)]
+        if state < len(options):
+            return options[state]
+        else:
+            return None
+    return completer
+
+
+def names(count):
+    return ['app-{:04d}-4313f4/behavior_{}'.format(i // BEHAVIORS_PER_APP,
+                                                   i % BEHAVIORS_PER_APP)
+            for i in xrange(count)]
+
+
+def press_tab(completer, text):
+    """Collect every completion of text as readline does."""
+    options = list()
+    while True:
+        option = completer(text, len(options))
+        if option is None:
+            return options
+        options.append(option)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark tab completion')
+    parser.add_argument('--names', type=int, default=50000)
+    args = parser.parse_args()
+    completions = names(args.names)
+    middle = completions[len(completions) // 2]
+    app = middle.split('/')[0]
+    # from a few hundred matches down to one, as the user types
+    prefixes = [app[:-8], app[:-7], app + '/', app + '/behavior_1', middle]
+    start = time.time()
+    indexed = clio.create_completer(completions)
+    build = time.time() - start
+    print('{} names, index built in {:.1f} ms'.format(len(completions), build * 1000))
+    total_old = total_new = 0.0
+    for text in prefixes:
+        start = time.time()
+        new = press_tab(indexed, text)
+        total_new += time.time() - start
+        start = time.time()
+        old = press_tab(scanning_completer(completions), text)
+        total_old += time.time() - start
+        if sorted(old) != new:
+            print('error: the completers disagree on {!r}'.format(text))
+            return 1
+        print('{:<36} {:5} matches'.format(repr(text), len(new)))
+    speedup = total_old / max(total_new, 1e-9)
+    print('scan {:.3f} s, indexed {:.4f} s ({:.0f}x)'.format(total_old, total_new, speedup))
+    if speedup < MIN_SPEEDUP:
+        print('error: the indexed completer is less than {}x faster'.format(MIN_SPEEDUP))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
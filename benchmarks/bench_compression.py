@@ -0,0 +1,109 @@
+"""
+bench_compression.py
+
+benchmark of the compression policy of packager.build on a synthetic
+media-heavy project (sounds, images and videos as random bytes, large
+incompressible files without a known extension, and Python, XML and dialog
+sources) against deflating every file, which qidev did before: the same build
+with every extension set to level 6, the level of zipfile.ZIP_DEFLATED.
+
+Exits non-zero when the policy is not at least MIN_SPEEDUP times faster, or
+when its package is more than MAX_GROWTH larger.
+
+usage: python benchmarks/bench_compression.py [--media 200] [--size 262144]
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import packager
+
+MEDIA = ('ogg', 'mp3', 'wav', 'png', 'jpg', 'mp4')
+SOURCES = ('py', 'xml', 'top', 'json')
+MIN_SPEEDUP = 2
+MAX_GROWTH = 0.01
+
+
+def make_tree(root, media, size):
+    """Write media media files of size random bytes, one random .dat file of
+    4 * size bytes (sampled, the extension is not known) for every 10 media
+    files and one source file of size / 8 bytes for every 2, plus a manifest."""
+    with open(os.path.join(root, 'manifest.xml'), 'w') as f:
+        f.write('<package uuid="bench" version="1.0.0"/>')
+    line = 'u:(hello) ^start(bench/behavior_1) hello there $name  # a dialog rule\n'
+    source = (line * (size // 8 // len(line) + 1))[:size // 8]
+    for i in xrange(media):
+        directory = os.path.join(root, 'behavior_{}'.format(i // 50))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'media_{}.{}'.format(i, MEDIA[i % len(MEDIA)])),
+                  'wb') as f:
+            f.write(os.urandom(size))
+        if i % 10 == 0:
+            with open(os.path.join(directory, 'model_{}.dat'.format(i)), 'wb') as f:
+                f.write(os.urandom(4 * size))
+        if i % 2 == 0:
+            with open(os.path.join(directory, 'source_{}.{}'.format(
+                    i, SOURCES[i // 2 % len(SOURCES)])), 'w') as f:
+                f.write(source)
+
+
+def extensions(root):
+    return set(packager.extension(rel_path) for _, rel_path in packager.walk_files(root))
+
+
+def build(root, dest, levels):
+    """Build serially, return (seconds, stats)."""
+    stats = dict()
+    start = time.time()
+    packager.build(root, dest, jobs=1, stats=stats, levels=levels)
+    return time.time() - start, stats
+
+
+def report(name, seconds, stats, dest):
+    print('{}: {:.2f} s, {:.1f} MB'.format(name, seconds, os.path.getsize(dest) / 1048576.0))
+    for ext, (files, size, compressed, spent) in sorted(stats.iteritems()):
+        print('  {:<6} {:4} files {:7.1f} MB to {:4.0%} in {:6.3f} s'.format(
+            '.' + ext, files, size / 1048576.0,
+            float(compressed) / size if size else 1, spent))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the compression policy')
+    parser.add_argument('--media', type=int, default=200, help='media files')
+    parser.add_argument('--size', type=int, default=262144, help='bytes per media file')
+    args = parser.parse_args()
+    work = tempfile.mkdtemp(prefix='qidev_bench_')
+    try:
+        tree = os.path.join(work, 'project')
+        os.makedirs(tree)
+        make_tree(tree, args.media, args.size)
+        deflate_all = dict((ext, 6) for ext in extensions(tree))
+        old_pkg, new_pkg = os.path.join(work, 'old.pkg'), os.path.join(work, 'new.pkg')
+        old_seconds, old_stats = build(tree, old_pkg, deflate_all)
+        new_seconds, new_stats = build(tree, new_pkg, dict())
+        report('deflate everything', old_seconds, old_stats, old_pkg)
+        report('compression policy', new_seconds, new_stats, new_pkg)
+        speedup = old_seconds / max(new_seconds, 1e-6)
+        growth = float(os.path.getsize(new_pkg)) / os.path.getsize(old_pkg) - 1
+        print('{:.1f}x faster, {:+.2%} size'.format(speedup, growth))
+        status = 0
+        if speedup < MIN_SPEEDUP:
+            print('error: the policy is less than {}x faster than deflating '
+                  'everything'.format(MIN_SPEEDUP))
+            status = 1
+        if growth > MAX_GROWTH:
+            print('error: the policy makes packages more than {:.0%} larger'.format(MAX_GROWTH))
+            status = 1
+        return status
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
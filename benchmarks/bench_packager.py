@@ -0,0 +1,104 @@
+"""
+bench_packager.py
+
+benchmark of packager.build against the serial packaging qidev used before it
+(zipfile.ZipFile.write of every file, as create_package and zip_dir did) on a
+synthetic project tree of many files. Exits non-zero if the archives do not
+hold the same files.
+
+usage: python benchmarks/bench_packager.py [--files 5000] [--size 16384] [--jobs N]
+"""
+
+import os
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import packager
+
+
+def make_tree(root, files, size):
+    """Write files files of about size bytes, half text and half random, in
+    directories of 100 files, plus a manifest."""
+    with open(os.path.join(root, 'manifest.xml'), 'w') as f:
+        f.write('<package uuid="bench" version="1.0.0"/>')
+    line = 'def behavior(self):\n    self.onStopped()  # a Choregraphe box\n'
+    for i in xrange(files):
+        directory = os.path.join(root, 'behavior_{}'.format(i // 100))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if i % 2:
+            data = (line * (size // len(line) + 1))[:size]
+        else:
+            data = os.urandom(size)
+        with open(os.path.join(directory, 'file_{}.py'.format(i)), 'wb') as f:
+            f.write(data)
+
+
+def zip_dir(path, dest):
+    """The serial packager qidev had before packager.build."""
+    zipf = zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED)
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            zipf.write(os.path.join(root, f),
+                       arcname=os.path.relpath(os.path.join(root, f), path))
+    zipf.close()
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def contents(pkg):
+    """Map each file of the archive to its CRC."""
+    zipf = zipfile.ZipFile(pkg)
+    try:
+        if zipf.testzip() is not None:
+            raise RuntimeError('{} is corrupt'.format(pkg))
+        return dict((i.filename, i.CRC) for i in zipf.infolist())
+    finally:
+        zipf.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the packager')
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=16384, help='bytes per file')
+    parser.add_argument('--jobs', type=int, default=packager.build_jobs())
+    args = parser.parse_args()
+    work = tempfile.mkdtemp(prefix='qidev_bench_')
+    try:
+        tree = os.path.join(work, 'project')
+        os.makedirs(tree)
+        make_tree(tree, args.files, args.size)
+        runs = [('zip_dir (serial zipfile)', zip_dir, os.path.join(work, 'old.pkg')),
+                ('packager.build jobs=1', lambda p, d: packager.build(p, d, jobs=1),
+                 os.path.join(work, 'serial.pkg')),
+                ('packager.build jobs={}'.format(args.jobs),
+                 lambda p, d: packager.build(p, d, jobs=args.jobs),
+                 os.path.join(work, 'parallel.pkg'))]
+        print('{} files of {} bytes'.format(args.files, args.size))
+        baseline = None
+        for name, func, dest in runs:
+            seconds = timed(func, tree, dest)
+            baseline = baseline or seconds
+            print('{:<28} {:7.2f} s {:6.2f}x {:8.1f} MB'.format(
+                name, seconds, baseline / seconds, os.path.getsize(dest) / 1048576.0))
+        expected = contents(runs[0][2])
+        for name, func, dest in runs[1:]:
+            if contents(dest) != expected:
+                print('error: {} does not hold the same files as zip_dir'.format(name))
+                return 1
+        return 0
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+bench_packages.py
+
+memory and time of building the package model (package_utils.Package) from
+synthetic packages2() payloads: PACKAGE_2 scaled up to many packages of many
+behaviors with names, tags, trigger sentences and loading responses. Each mode
+runs in a fresh interpreter, so its peak RSS is its own:
+
+  headers   uuid, name and version of every package (qidev show, remove)
+  launch    the launch path of every behavior (PackageSet.by_launch_path)
+  full      every field of every package and behavior, which is what
+            Package.__init__ computed eagerly before the fields were lazy
+
+Exits non-zero when the headers mode is not much cheaper than the full mode.
+
+usage: python benchmarks/bench_packages.py [--packages 200] [--behaviors 50]
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import package_utils as pu
+
+MODES = ('headers', 'launch', 'full')
+LANG = 'en_US'
+# the headers mode fails above this share of the time of the full mode
+MAX_HEADERS_SHARE = 0.25
+
+
+def payload(packages, behaviors):
+    """Return packages copies of PACKAGE_2 with behaviors behaviors each."""
+    packs = list()
+    for p in xrange(packages):
+        pack = copy.deepcopy(pu.PACKAGE_2)
+        uuid = 'bench-app-{}-4313f4'.format(p)
+        pack['uuid'] = uuid
+        pack['path'] = '/home/nao/.local/share/PackageManager/apps/' + uuid
+        pack['elems']['names'] = {LANG: 'Bench App {}'.format(p)}
+        template = pack['elems']['contents']['behaviors'][0]
+        behs = list()
+        for b in xrange(behaviors):
+            beh = copy.deepcopy(template)
+            beh['path'] = 'animations/waveHello_{}'.format(b)
+            beh['langToName'] = {LANG: 'wave hello {}'.format(b)}
+            beh['langToDesc'] = {LANG: 'Wave at people in front of the robot'}
+            beh['langToTags'] = {LANG: ['wave', 'hello', 'greeting', 'arm']}
+            beh['langToTriggerSentences'] = {LANG: ['wave {}'.format(b), 'say hello',
+                                                    'greet everybody']}
+            beh['langToLoadingResponses'] = {LANG: ['here I go', 'hello there']}
+            beh['purposeToCondition'] = {'launchTrigger': ['(\'Launchpad/FocusedActivity\' == "")']}
+            behs.append(beh)
+        pack['elems']['contents']['behaviors'] = behs
+        packs.append(pack)
+    return packs
+
+
+def fields(cls):
+    """Names of the lazy fields and properties of a package_utils class."""
+    return [name for name, value in vars(cls).items()
+            if isinstance(value, (pu.lazy, property))]
+
+
+def run(mode, packages, behaviors):
+    """Build the model of the payload in this process and report on stdout."""
+    packs = payload(packages, behaviors)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    model = [pu.Package(d, LANG) for d in packs]
+    if mode == 'launch':
+        pu.PackageSet(model).launch_paths()
+    elif mode == 'full':
+        package_fields, behavior_fields = fields(pu.Package), fields(pu.Behavior)
+        for package in model:
+            for name in package_fields:
+                getattr(package, name)
+            for behavior in package.behaviors:
+                for name in behavior_fields:
+                    getattr(behavior, name)
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'seconds': seconds, 'kb': peak - before}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the package model')
+    parser.add_argument('--packages', type=int, default=200)
+    parser.add_argument('--behaviors', type=int, default=50, help='behaviors per package')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        run(args.mode, args.packages, args.behaviors)
+        return 0
+    print('{} packages of {} behaviors'.format(args.packages, args.behaviors))
+    results = dict()
+    for mode in MODES:
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--packages', str(args.packages), '--behaviors', str(args.behaviors)])
+        results[mode] = json.loads(output)
+        print('{:<8} {:8.3f} s {:9.1f} MB'.format(
+            mode, results[mode]['seconds'], results[mode]['kb'] / 1024.0))
+    full = results['full']['seconds']
+    print('headers are {:.0f}x faster than building every field'.format(
+        full / max(results['headers']['seconds'], 1e-6)))
+    if results['headers']['seconds'] > MAX_HEADERS_SHARE * full:
+        print('error: reading the headers costs more than {:.0%} of building every '
+              'field; are the fields computed eagerly again?'.format(MAX_HEADERS_SHARE))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
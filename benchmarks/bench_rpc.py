@@ -0,0 +1,155 @@
+"""
+bench_rpc.py
+
+benchmark of the Connection query layer against a fake qi session whose every
+service lookup and call takes --latency seconds, like a round trip over Wi-Fi.
+Compares the blocking one-call-at-a-time queries qidev made before
+(session.service for every method, one isServiceRunning per service, ten calls
+for info) with Connection.get_running_services and Connection.get_info, which
+cache service proxies and gather their calls as futures.
+
+Exits non-zero when the gathered queries are not much faster than blocking
+ones, i.e. when calls are serialized again.
+
+usage: python benchmarks/bench_rpc.py [--latency 0.05] [--services 40]
+"""
+
+import os
+import imp
+import sys
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+# sessions are faked, so the benchmark runs without NAOqi: connection only
+# needs qi to import
+qi = sys.modules['qi'] = imp.new_module('qi')
+qi.Session = None
+qi.logging = imp.new_module('qi.logging')
+qi.logging.setLevel = lambda level: None
+from connection import Connection
+
+# the gathered queries fail above this share of the time of blocking ones
+MAX_SHARE = 0.5
+
+
+class FakeFuture(object):
+    """A qi.Future whose value arrives after latency seconds."""
+
+    def __init__(self, latency, value):
+        self._value = value
+        self._done = threading.Event()
+        timer = threading.Timer(latency, self._done.set)
+        timer.daemon = True
+        timer.start()
+
+    def value(self, timeout_ms=None):
+        if not self._done.wait(None if timeout_ms is None else timeout_ms / 1000.0):
+            raise RuntimeError('timeout')
+        return self._value
+
+
+class FakeService(object):
+    """A service proxy: every method answers after latency seconds."""
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            self.session.calls += 1
+            value = self.session.answer(self.name, method, args)
+            if kwargs.get('_async'):
+                return FakeFuture(self.session.latency, value)
+            time.sleep(self.session.latency)
+            return value
+        return call
+
+
+class FakeSession(object):
+    """A qi.Session whose service lookups and calls take latency seconds."""
+
+    def __init__(self, latency, services):
+        self.latency = latency
+        self.services = services
+        self.calls = 0
+
+    def service(self, name):
+        self.calls += 1
+        time.sleep(self.latency)
+        return FakeService(self, name)
+
+    def answer(self, service, method, args):
+        if method == 'services':
+            return [{'name': 'service_{}'.format(i), 'execStart': '', 'running': i % 2 == 0}
+                    for i in xrange(self.services)]
+        if method == 'isServiceRunning':
+            return int(args[0].rsplit('_', 1)[1]) % 2 == 0
+        if method == 'getAvailableLanguages':
+            return ['English', 'French']
+        if method == 'getOutputVolume':
+            return 60
+        return '{}.{}'.format(service, method)
+
+    def close(self):
+        pass
+
+
+def blocking_running_services(session):
+    """get_running_services as it was: one blocking call per declared service."""
+    services = [s['name'] for s in session.service('ALServiceManager').services()]
+    return [s for s in services
+            if session.service('ALServiceManager').isServiceRunning(s)]
+
+
+def blocking_info(session):
+    """The calls of 'qidev info' one after another, resolving every service."""
+    return [getattr(session.service(service), method)() for service, method in [
+        ('ALSystem', 'robotName'), ('ALSystem', 'systemVersion'),
+        ('ALTextToSpeech', 'getLanguage'), ('ALTextToSpeech', 'getAvailableLanguages'),
+        ('ALAudioDevice', 'getOutputVolume'), ('ALRobotPosture', 'getPosture'),
+        ('ALRobotPosture', 'getPostureFamily'), ('ALAutonomousLife', 'focusedActivity'),
+        ('ALAutonomousLife', 'getState')]]
+
+
+def connection(session):
+    conn = Connection(lambda text: None, hostname='127.0.0.1', ssh=False, qi_session=False)
+    conn._session = session
+    return conn
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the qi query layer')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds per service lookup or call')
+    parser.add_argument('--services', type=int, default=40, help='declared services')
+    args = parser.parse_args()
+    print('{:.0f} ms per call, {} declared services'.format(args.latency * 1000, args.services))
+    failures = list()
+    queries = [('running services', blocking_running_services,
+                lambda session: connection(session).get_running_services()),
+               ('info', blocking_info, lambda session: connection(session).get_info())]
+    for name, blocking, gathered in queries:
+        before = FakeSession(args.latency, args.services)
+        after = FakeSession(args.latency, args.services)
+        slow, fast = timed(blocking, before), timed(gathered, after)
+        print('{:<18} blocking {:6.2f} s ({:3} calls)  gathered {:6.2f} s ({:3} calls)  '
+              '{:5.1f}x'.format(name, slow, before.calls, fast, after.calls, slow / fast))
+        if fast > MAX_SHARE * slow:
+            failures.append(name)
+    if failures:
+        print('error: {} no longer gathered'.format(', '.join(failures)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
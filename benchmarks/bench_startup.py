@@ -0,0 +1,231 @@
+"""
+bench_startup.py
+
+startup cost of every qidev subcommand: the modules imported and the time spent
+until its handler returns, each in a fresh interpreter. Python 2 has no
+-X importtime, so imports are timed by wrapping __import__ (cumulative time of
+each module, nested imports included). Handlers run for real against a stand-in
+robot at 127.0.0.1: qi and paramiko are replaced by stubs that answer every call
+or refuse SSH, so the time is the cost of qidev itself and a stub shows in the
+modules of a command only if its handler imported qi or paramiko.
+
+Exits non-zero when a command loads one of HEAVY that ALLOWED does not give it
+(e.g. paramiko in a command without SSH), or, with --baseline, when a command
+runs more than TOLERANCE slower than recorded.
+
+usage: python benchmarks/bench_startup.py [--save FILE | --baseline FILE] [-v]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+COMMANDS = [['config', 'bench_field', '1'], ['connect', '127.0.0.1'], ['group'],
+            ['tag', '127.0.0.1'], ['agent', 'status'], ['info'], ['install', '.'],
+            ['cache'], ['remove'], ['show'], ['start'], ['stop'], ['life', 'on'],
+            ['nao', 'restart'], ['reboot'], ['shutdown'], ['rest'], ['wake'],
+            ['vol', '50'], ['dialog'], ['log']]
+# third-party and expensive standard modules, and the qidev modules that pull
+# them in: a command may only import those ALLOWED gives it
+HEAVY = ['qi', 'paramiko', 'scp', 'tabulate', 'clint', 'readline', 'SocketServer',
+         'cPickle', 'hashlib', 'zipfile', 'sqlite3', 'multiprocessing', 'xml.etree',
+         'lib.clio', 'lib.connection', 'lib.cache', 'lib.agent', 'lib.logs',
+         'lib.packager', 'lib.fleet', 'lib.groups', 'lib.transfer', 'lib.archive',
+         'lib.package_utils']
+CLIO = ['tabulate', 'clint', 'lib.clio']
+CACHE = ['hashlib', 'zipfile', 'xml.etree', 'lib.cache', 'lib.packager']
+GROUPS = ['clint', 'lib.groups'] + CACHE
+CONNECTION = ['qi', 'lib.connection', 'lib.transfer', 'lib.package_utils'] + CLIO + GROUPS
+AGENT = ['clint', 'SocketServer', 'cPickle', 'lib.agent']
+SSH = ['paramiko']
+# the modules of HEAVY each command needs; robot commands without SSH must
+# not import paramiko
+ALLOWED = dict(config=[], connect=CONNECTION, group=CLIO + GROUPS, tag=GROUPS, agent=AGENT,
+               info=CONNECTION, install=CONNECTION + SSH + ['cPickle', 'multiprocessing'],
+               cache=CLIO + CACHE, nao=CONNECTION + SSH, dialog=CONNECTION,
+               log=CONNECTION + SSH + ['lib.logs'])
+for command in ('remove', 'show', 'start', 'stop', 'life', 'reboot', 'shutdown', 'rest',
+                'wake', 'vol'):
+    ALLOWED[command] = CONNECTION + AGENT
+# allowed slowdown against a baseline: a ratio, plus seconds of noise
+TOLERANCE = (1.5, 0.02)
+# seconds a command may take against the stand-in robot
+TIMEOUT = 60
+
+PROBE = r'''
+import os, sys, imp, time, json, __builtin__
+start = time.time()
+timings = dict()
+real_import = __builtin__.__import__
+
+def timed_import(name, *args, **kwargs):
+    before = time.time()
+    try:
+        return real_import(name, *args, **kwargs)
+    finally:
+        timings[name] = timings.get(name, 0) + time.time() - before
+
+
+class Stub(object):
+    """Any attribute, call or result of a robot that answers everything."""
+    def __init__(self, *args, **kwargs):
+        pass
+    def __getattr__(self, name):
+        return Stub()
+    def __call__(self, *args, **kwargs):
+        return Stub()
+    def __iter__(self):
+        return iter(())
+    def __len__(self):
+        return 0
+
+
+class SSHException(Exception):
+    pass
+
+
+class SSHClient(Stub):
+    def connect(self, *args, **kwargs):
+        raise SSHException('stand-in robot')
+
+
+class StandIns(object):
+    """Provide qi and paramiko when they are imported (and only then), so
+    that handlers run without a robot and their imports show in sys.modules."""
+    modules = {'qi': dict(Session=Stub, logging=Stub()),
+               'paramiko': dict(SSHClient=SSHClient, SSHException=SSHException,
+                                AutoAddPolicy=Stub, SFTPClient=Stub)}
+
+    def find_module(self, name, path=None):
+        return self if name in self.modules else None
+
+    def load_module(self, name):
+        module = sys.modules.setdefault(name, imp.new_module(name))
+        module.__dict__.update(self.modules[name])
+        return module
+
+sys.meta_path.insert(0, StandIns())
+__builtin__.__import__ = timed_import
+root, argv = sys.argv[1], json.loads(sys.argv[2])
+sys.path.insert(0, root)
+sys.argv = ['qidev'] + argv
+import lib.qidev
+import lib.handlers as hs
+name = argv[0] + '_handler'
+handler = getattr(hs, name)
+
+def run(ns):
+    try:
+        handler(ns)
+    except BaseException as e:  # the stand-in robot fails commands
+        sys.stderr.write('{}: {}\n'.format(type(e).__name__, e))
+    __builtin__.__import__ = real_import
+    sys.stdout.write('\n' + json.dumps({
+        'seconds': time.time() - start,
+        'modules': sorted(m for m, v in sys.modules.items() if v is not None),
+        'imports': sorted(timings.items(), key=lambda t: t[1], reverse=True)[:5]}))
+    sys.stdout.flush()
+    os._exit(0)  # without waiting for the SSH thread
+
+setattr(hs, name, run)
+lib.qidev.main()
+'''
+
+
+def setup(home):
+    """Configure 127.0.0.1 as the robot, recorded as a real one (see
+    connection.is_virtual) so that the SSH paths run, and write a project."""
+    with open(os.path.join(home, '.qidev'), 'w') as f:
+        json.dump({'hostname': '127.0.0.1', 'address_ttl': 86400, 'upload_retries': 0}, f)
+    os.makedirs(os.path.join(home, '.qidev_cache'))
+    with open(os.path.join(home, '.qidev_cache', 'ssh_hosts.json'), 'w') as f:
+        json.dump({'127.0.0.1': time.time()}, f)
+    project = os.path.join(home, 'project')
+    os.makedirs(project)
+    with open(os.path.join(project, 'manifest.xml'), 'w') as f:
+        f.write('<package uuid="bench" version="1.0.0"/>')
+    with open(os.path.join(project, 'behavior.xar'), 'w') as f:
+        f.write('<ChoregrapheProject/>')
+    return project
+
+
+def measure(argv, home, project):
+    """Run qidev argv in a fresh interpreter until its handler returns."""
+    env = dict(os.environ, HOME=home)
+    with open(os.devnull, 'r+') as null:
+        child = subprocess.Popen([sys.executable, '-c', PROBE, ROOT, json.dumps(argv)],
+                                 cwd=project, env=env, stdin=null, stdout=subprocess.PIPE,
+                                 stderr=null)
+        timer = threading.Timer(TIMEOUT, child.kill)
+        timer.start()
+        try:
+            output = child.communicate()[0]
+        finally:
+            timer.cancel()
+    if child.returncode:
+        raise RuntimeError('qidev {} failed or ran longer than {} s'.format(' '.join(argv), TIMEOUT))
+    return json.loads(output.splitlines()[-1])
+
+
+def heavy(modules):
+    """The modules of HEAVY in modules, with their submodules."""
+    loaded = set(modules)
+    return [m for m in HEAVY if m in loaded or any(n.startswith(m + '.') for n in loaded)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark qidev startup')
+    parser.add_argument('--save', help='write the timings to this JSON file')
+    parser.add_argument('--baseline', help='fail on regressions against this JSON file')
+    parser.add_argument('--runs', type=int, default=5, help='best of this many runs')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show the slowest imports of each command')
+    args = parser.parse_args()
+    baseline = dict()
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    home = tempfile.mkdtemp(prefix='qidev_bench_')
+    failures, timings = list(), dict()
+    try:
+        project = setup(home)
+        for argv in COMMANDS:
+            runs = [measure(argv, home, project) for _ in xrange(args.runs)]
+            result = min(runs, key=lambda r: r['seconds'])
+            command, seconds = argv[0], result['seconds']
+            timings[command] = seconds
+            loaded = [m for m in heavy(result['modules']) if m not in ALLOWED[command]]
+            status = 'ok'
+            if loaded:
+                status = 'imports ' + ', '.join(loaded)
+            elif command in baseline:
+                limit = baseline[command] * TOLERANCE[0] + TOLERANCE[1]
+                if seconds > limit:
+                    status = 'slower than {:.1f} ms'.format(limit * 1000)
+            if status != 'ok':
+                failures.append(command)
+            print('{:<10} {:7.1f} ms {:4} modules  {}'.format(
+                command, seconds * 1000, len(result['modules']), status))
+            if args.verbose:
+                for name, spent in result['imports']:
+                    print('    {:<24} {:7.1f} ms'.format(name, spent * 1000))
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(timings, f, indent=2, sort_keys=True)
+    if failures:
+        print('error: startup regressed for {}'.format(' '.join(failures)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,387 @@
+"""
+bench_transfer.py
+
+upload throughput of transfer.upload (pipelined SFTP writes in a tuned window,
+checked with SHA-256 on the server) against scp.SCPClient.put with paramiko
+defaults, which Connection.transfer used before. Both upload to a local paramiko
+SSH server stand-in: an SFTP server, an scp sink and sha256sum, on the files of
+a temporary directory. A relay between client and server delays each direction
+by half of --latency seconds, like a round trip over Wi-Fi.
+
+The upload does more than scp did: it waits for the acknowledgements of every
+SEGMENT, checks the SHA-256 of the file on both ends and renames it, so it does
+not reach the throughput of scp (about half of it with paramiko 1.14 on one
+core). The share of the throughput of scp it reaches is compared with the one
+recorded in BASELINE, or --baseline, for the same paramiko, --size and
+--latency; the benchmark exits non-zero below TOLERANCE of it (e.g. writes are
+no longer pipelined). --save records a new baseline.
+
+usage: python benchmarks/bench_transfer.py [--size 32] [--latency 0.02]
+                                           [--save FILE | --baseline FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import shlex
+import Queue
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import paramiko
+from scp import SCPClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+import transfer
+
+BUFSIZE = 65536
+SERVER_WINDOW = 2 * 1024 * 1024
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_transfer.json')
+# the upload fails below this part of the recorded share of the throughput of scp
+TOLERANCE = 0.8
+
+
+class Handle(paramiko.SFTPHandle):
+    """A file whose writes are acknowledged at once and written to disk in a
+    background thread, so that handling a write request costs the stand-in
+    no more than receiving the same bytes over scp costs scp_sink."""
+
+    def __init__(self, flags=0):
+        paramiko.SFTPHandle.__init__(self, flags)
+        self.writes = Queue.Queue()
+        self.error = None
+        start_daemon(self.write_behind)
+
+    def write_behind(self):
+        while True:
+            offset, data = self.writes.get()
+            try:
+                if data is not None and not self.error:
+                    self.writefile.seek(offset)
+                    self.writefile.write(data)
+            except IOError as e:
+                self.error = e
+            finally:
+                self.writes.task_done()
+            if data is None:
+                return
+
+    def write(self, offset, data):
+        self.writes.put((offset, data))
+        return paramiko.SFTP_OK
+
+    def flush(self):
+        """Wait for the writes so far, return an SFTP status."""
+        self.writes.join()
+        if self.error:
+            return paramiko.SFTPServer.convert_errno(self.error.errno)
+        self.writefile.flush()
+        return paramiko.SFTP_OK
+
+    def stat(self):
+        status = self.flush()
+        if status != paramiko.SFTP_OK:
+            return status
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def close(self):
+        self.flush()
+        self.writes.put((None, None))
+        paramiko.SFTPHandle.close(self)
+
+
+class StandInSFTP(paramiko.SFTPServerInterface):
+    """The SFTP requests transfer.upload makes, on the files under server.root."""
+
+    def __init__(self, server, *args, **kwargs):
+        paramiko.SFTPServerInterface.__init__(self, server, *args, **kwargs)
+        self.root = server.root
+
+    def path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def open(self, remote_path, flags, attr):
+        try:
+            fd = os.open(self.path(remote_path), flags, 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_APPEND:
+            mode = 'ab'
+        elif flags & os.O_RDWR:
+            mode = 'r+b'
+        else:
+            mode = 'wb' if flags & os.O_WRONLY else 'rb'
+        handle = Handle(flags)
+        handle.filename = self.path(remote_path)
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def stat(self, remote_path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.path(remote_path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def remove(self, remote_path):
+        try:
+            os.remove(self.path(remote_path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, old_path, new_path):
+        os.rename(self.path(old_path), self.path(new_path))
+        return paramiko.SFTP_OK
+
+    posix_rename = rename
+
+    def chattr(self, remote_path, attr):
+        if attr.st_size is not None:
+            with open(self.path(remote_path), 'r+b') as f:
+                f.truncate(attr.st_size)
+        return paramiko.SFTP_OK
+
+
+class StandInServer(paramiko.ServerInterface):
+    """Accept any password and run 'scp -t PATH' and 'sha256sum PATH'."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        args = shlex.split(command)
+        if args[:2] == ['scp', '-t']:
+            target = scp_sink
+        elif args[0] == 'sha256sum':
+            target = sha256sum
+        else:
+            return False
+        path = os.path.join(self.root, args[-1].lstrip('/'))
+        thread = threading.Thread(target=target, args=(channel, path))
+        thread.daemon = True
+        thread.start()
+        return True
+
+
+def scp_sink(channel, path):
+    """Receive one file as 'scp -t path' does."""
+    stream = channel.makefile('rb')
+    channel.sendall('\0')
+    line = stream.readline()
+    while line.startswith('T'):  # modification times
+        channel.sendall('\0')
+        line = stream.readline()
+    remaining = int(line.split()[1])
+    channel.sendall('\0')
+    with open(path, 'wb') as f:
+        while remaining:
+            data = stream.read(min(BUFSIZE, remaining))
+            f.write(data)
+            remaining -= len(data)
+    stream.read(1)
+    channel.sendall('\0')
+    channel.send_exit_status(0)
+    channel.close()
+
+
+def sha256sum(channel, path):
+    channel.sendall('{}  {}\n'.format(transfer.file_sha256(path), path))
+    channel.send_exit_status(0)
+    channel.close()
+
+
+def serve(root):
+    """Run the SSH server stand-in in the background, return its port."""
+    key = paramiko.RSAKey.generate(2048)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            t = paramiko.Transport(client)
+            # the receive window of OpenSSH, which robots run (paramiko < 1.15 and >= 1.15)
+            t.window_size = t.default_window_size = SERVER_WINDOW
+            t.add_server_key(key)
+            t.set_subsystem_handler('sftp', paramiko.SFTPServer, StandInSFTP)
+            t.start_server(server=StandInServer(root))
+    start_daemon(accept)
+    return listener.getsockname()[1]
+
+
+def relay(port, delay):
+    """Forward connections to port, each direction delayed by delay seconds.
+    Return the port to connect to."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+
+    def pump(source, sink):
+        queue = Queue.Queue()
+
+        def receive():
+            while True:
+                try:
+                    data = source.recv(BUFSIZE)
+                except socket.error:  # reset, as a closed connection
+                    data = ''
+                queue.put((time.time() + delay, data))
+                if not data:
+                    return
+
+        def deliver():
+            try:
+                while True:
+                    due, data = queue.get()
+                    time.sleep(max(due - time.time(), 0))
+                    if not data:
+                        sink.shutdown(socket.SHUT_WR)
+                        return
+                    sink.sendall(data)
+            except socket.error:  # the other end is gone
+                pass
+        start_daemon(receive)
+        start_daemon(deliver)
+
+    def accept():
+        while True:
+            client, _ = listener.accept()
+            server = socket.create_connection(('127.0.0.1', port))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            pump(client, server)
+            pump(server, client)
+    start_daemon(accept)
+    return listener.getsockname()[1]
+
+
+def start_daemon(target):
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+
+
+def ssh_client(port):
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect('127.0.0.1', port, username='nao', password='nao',
+                   allow_agent=False, look_for_keys=False)
+    return client
+
+
+def scp_put(port, local_path, remote_path):
+    """Connection.transfer as it was."""
+    client = ssh_client(port)
+    try:
+        start = time.time()
+        SCPClient(client.get_transport()).put(local_path, remote_path)
+        return time.time() - start
+    finally:
+        client.close()
+
+
+def upload(port, local_path, remote_path):
+    client = ssh_client(port)
+    try:
+        _, seconds = transfer.upload('bench', client.get_transport, local_path, remote_path,
+                                     max_retries=0)
+        return seconds
+    finally:
+        client.close()
+
+
+def run_server(root, latency):
+    """Serve root behind the relay until stdin is closed."""
+    port = relay(serve(root), latency / 2)
+    sys.stdout.write('{}\n'.format(port))
+    sys.stdout.flush()
+    sys.stdin.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark package uploads')
+    parser.add_argument('--size', type=int, default=32, help='MB uploaded')
+    parser.add_argument('--latency', type=float, default=0.02, help='round trip in seconds')
+    parser.add_argument('--save', help='write the throughput to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='fail on regressions against this JSON file')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        run_server(args.serve, args.latency)
+        return 0
+    tmp = tempfile.mkdtemp()
+    server = None
+    try:
+        root = os.path.join(tmp, 'robot')
+        os.mkdir(root)
+        # upload progress is recorded next to the package, not in the cache
+        transfer.progress_path = lambda hostname: os.path.join(tmp, hostname + '.json')
+        local_path = os.path.join(tmp, 'bench.pkg')
+        with open(local_path, 'wb') as f:
+            for _ in xrange(args.size):
+                f.write(os.urandom(1048576))
+        digest = transfer.file_sha256(local_path)
+        # in its own interpreter, so that the server does not compete with the
+        # client for the GIL (sftp-server on a robot is not Python)
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', root,
+                                   '--latency', str(args.latency)],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        port = int(server.stdout.readline())
+        size = args.size * 1048576.0
+        print('{} MB, {:.0f} ms round trip, paramiko {}'.format(
+            args.size, args.latency * 1000, paramiko.__version__))
+        rates = dict()
+        for name, func in (('scp', scp_put), ('upload', upload)):
+            remote_path = '/{}.pkg'.format(name)
+            seconds = func(port, local_path, remote_path)
+            if transfer.file_sha256(os.path.join(root, name + '.pkg')) != digest:
+                print('error: {} uploaded a different file'.format(name))
+                return 1
+            rates[name] = size / seconds / 1048576
+            print('{:<7} {:7.2f} s {:7.1f} MB/s'.format(name, seconds, rates[name]))
+    finally:
+        if server:
+            server.stdin.close()
+            server.wait()
+        shutil.rmtree(tmp)
+    share = rates['upload'] / rates['scp']
+    print('upload reaches {:.0%} of the throughput of scp'.format(share))
+    run = {'paramiko': paramiko.__version__, 'size': args.size, 'latency': args.latency}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(run, share=round(share, 2), **rates), f, indent=2, sort_keys=True)
+        return 0
+    with open(args.baseline, 'r') as f:
+        recorded = json.load(f)
+    if any(recorded[k] != v for k, v in run.items()):
+        print('error: {} was recorded with {}, save a baseline for this run'.format(
+            args.baseline, ', '.join('{} {}'.format(k, recorded[k]) for k in sorted(run))))
+        return 1
+    if share < recorded['share'] * TOLERANCE:
+        print('error: {:.0%} of the throughput of scp, {:.0%} recorded; are writes still '
+              'pipelined?'.format(share, recorded['share']))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+"""
+agent.py
+
+An optional background process that keeps warm Connections (qi session and
+SSH transport) keyed by hostname. CLI commands forward Connection method calls
+to it over a Unix socket instead of connecting to the robot themselves.
+
+Messages are length-prefixed pickles; the socket is only accessible to the user
+that started the agent.
+"""
+
+import os
+import time
+import errno
+import socket
+import struct
+import cPickle as pickle
+import threading
+import SocketServer
+import config
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser('~'), '.qidev_agent.sock')
+DEFAULT_IDLE_TIMEOUT = 600  # seconds before an unused connection is closed
+HEADER = struct.Struct('!I')
+
+_running = None
+
+
+def socket_path():
+    """Return the path of the agent's Unix socket (config field agent_socket)."""
+    path = config.read_field('agent_socket')
+    return os.path.expanduser(path) if path else DEFAULT_SOCKET
+
+
+def idle_timeout():
+    """Return the idle eviction delay (config field agent_idle_timeout)."""
+    try:
+        return float(config.read_field('agent_idle_timeout'))
+    except (TypeError, ValueError):
+        return DEFAULT_IDLE_TIMEOUT
+
+
+def send_msg(sock, obj):
+    data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_exactly(sock, n):
+    chunks = list()
+    while n:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise EOFError('agent closed the connection')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return ''.join(chunks)
+
+
+def recv_msg(sock):
+    size, = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return pickle.loads(recv_exactly(sock, size))
+
+
+def request(message):
+    """Send one request to the agent and return its reply; exceptions raised
+    in the agent are re-raised here."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path())
+        send_msg(sock, message)
+        ok, value = recv_msg(sock)
+    finally:
+        sock.close()
+    if not ok:
+        raise value
+    return value
+
+
+def running():
+    """Is an agent listening on the socket? Checked once per process."""
+    global _running
+    if _running is None:
+        try:
+            _running = request({'command': 'ping'}) == 'pong'
+        except (socket.error, EOFError):
+            _running = False
+    return _running
+
+
+class AgentConnection(object):
+    """Stand-in for a Connection whose method calls run in the agent."""
+
+    def __init__(self, verb, hostname=None, ssh=True, qi_session=True):
+        self.verb = verb
+        if not hostname:
+            hostname = str(config.read_field('hostname'))
+        self.hostname = hostname
+        self.ssh_required = ssh
+        verb('Use agent connection to {}'.format(self.hostname))
+
+    def call(self, method, *args):
+        return request({'command': 'call',
+                        'hostname': self.hostname,
+                        'ssh': self.ssh_required,
+                        'method': method,
+                        'args': args})
+
+    def get_installed_package_data(self, verb, refresh=False):
+        # the verbose print function cannot cross the socket
+        return self.call('get_installed_package_data', refresh)
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
+
+
+def connection(verb, hostname=None, ssh=True, qi_session=True):
+    """Return an AgentConnection if the agent is running, a Connection otherwise."""
+    if running():
+        return AgentConnection(verb, hostname=hostname, ssh=ssh, qi_session=qi_session)
+    from connection import Connection
+    return Connection(verb, hostname=hostname, ssh=ssh, qi_session=qi_session)
+
+
+class Pool(object):
+    """Warm Connections keyed by hostname, with idle eviction and health checks."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.conns = dict()  # hostname -> [Connection, last use]
+        self.lock = threading.Lock()
+        self.host_locks = dict()
+
+    @staticmethod
+    def healthy(conn, ssh):
+        if conn.session and not conn.session.isConnected():
+            return False
+        if ssh and not conn.virtual:
+            try:
+                transport = conn.ssh.get_transport()
+            except RuntimeError:  # SSH could not be opened, try a new Connection
+                return False
+            if not transport or not transport.is_active():
+                return False
+        return True
+
+    def get(self, hostname, ssh):
+        with self.lock:
+            host_lock = self.host_locks.setdefault(hostname, threading.Lock())
+        with host_lock:
+            entry = self.conns.get(hostname)
+            if entry and not self.healthy(entry[0], ssh):
+                entry[0].close()
+                entry = None
+            if not entry:
+                from connection import Connection
+                conn = Connection(lambda text: None, hostname=hostname, ssh=ssh)
+                entry = self.conns[hostname] = [conn, time.time()]
+            entry[1] = time.time()
+            return entry[0]
+
+    def evict_idle(self):
+        now = time.time()
+        with self.lock:
+            idle = [h for h, (_, used) in self.conns.items() if now - used > self.timeout]
+        for hostname in idle:
+            with self.host_locks[hostname]:
+                entry = self.conns.get(hostname)
+                if entry and now - entry[1] > self.timeout:
+                    del self.conns[hostname]
+                    entry[0].close()
+
+    def status(self):
+        now = time.time()
+        return sorted((h, now - used) for h, (_, used) in self.conns.items())
+
+    def close(self):
+        for conn, _ in self.conns.values():
+            conn.close()
+        self.conns.clear()
+
+
+class Handler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            message = recv_msg(self.request)
+        except EOFError:
+            return
+        try:
+            reply = (True, self.server.dispatch(message))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            send_msg(self.request, reply)
+        except pickle.PicklingError as e:
+            send_msg(self.request, (False, RuntimeError(str(e))))
+
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, timeout):
+        self.pool = Pool(timeout)
+        SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        os.chmod(path, 0600)
+
+    def dispatch(self, message):
+        command = message['command']
+        if command == 'ping':
+            return 'pong'
+        elif command == 'status':
+            return self.pool.status()
+        elif command == 'shutdown':
+            threading.Thread(target=self.shutdown).start()
+            return 'bye'
+        elif command == 'call':
+            conn = self.pool.get(message['hostname'], message['ssh'])
+            method = getattr(conn, message['method'])
+            if message['method'] == 'get_installed_package_data':
+                return method(lambda text: None, *message['args'])
+            return method(*message['args'])
+        raise RuntimeError('unknown agent command: {}'.format(command))
+
+
+def serve(path, timeout):
+    """Run the agent in the current process until it is asked to shut down."""
+    try:
+        os.remove(path)  # stale socket of an agent that did not exit cleanly
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    server = Server(path, timeout)
+
+    def evict():
+        while True:
+            time.sleep(min(timeout, 30))
+            server.pool.evict_idle()
+
+    evictor = threading.Thread(target=evict)
+    evictor.daemon = True
+    evictor.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.pool.close()
+        server.server_close()
+        os.remove(path)
+
+
+def start():
+    """Start the agent as a daemon and wait until it accepts requests."""
+    path, timeout = socket_path(), idle_timeout()
+    pid = os.fork()
+    if pid == 0:
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            serve(path, timeout)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    global _running
+    for _ in range(50):
+        _running = None
+        if running():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def stop():
+    return request({'command': 'shutdown'})
+
+
+def status():
+    return request({'command': 'status'})
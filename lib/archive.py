@@ -0,0 +1,135 @@
+"""
+archive.py
+
+a local SQLite archive of collected NAOqi logs. Lines are parsed once when
+they are ingested and indexed on time, level and category, so queries across
+robots and days do not grep the flat files again.
+"""
+
+import os
+import re
+import sqlite3
+import logs
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS lines (
+    robot TEXT, time REAL, level TEXT, thread TEXT, category TEXT, message TEXT);
+CREATE INDEX IF NOT EXISTS lines_time ON lines (time);
+CREATE INDEX IF NOT EXISTS lines_level ON lines (level, time);
+CREATE INDEX IF NOT EXISTS lines_category ON lines (category, time);
+CREATE TABLE IF NOT EXISTS sources (
+    robot TEXT, path TEXT, offset INTEGER, PRIMARY KEY (robot, path));
+'''
+BATCH = 10000  # rows inserted per executemany
+
+
+def connect(path):
+    """Open (and create if needed) the archive at path."""
+    db = sqlite3.connect(path)
+    db.text_factory = str
+    db.create_function('REGEXP', 2, regexp)
+    db.executescript(SCHEMA)
+    return db
+
+
+def regexp(pattern, value):
+    """SQLite's 'value REGEXP pattern': is pattern found in value, as the
+    category filter of logs.make_filter does."""
+    return value is not None and re.search(pattern, value) is not None
+
+
+def parse_lines(f):
+    """Yield (time, level, thread, category, message) for each log line of f;
+    continuation lines are appended to the message of the line before them."""
+    row = None
+    for line in f:
+        line = line.rstrip('\n')
+        fields = logs.parse(line)
+        if fields:
+            if row:
+                yield row
+            level, timestamp, thread, category, message = fields
+            try:
+                row = [float(timestamp), level, thread, category, message]
+            except ValueError:
+                row = None
+        elif row:
+            row[4] += '\n' + line
+    if row:
+        yield row
+
+
+def ingest(db, robot, path):
+    """Add the lines of the log file at path to the archive, starting where the
+    last ingestion of this file stopped (logs are collected by appending).
+    :return: the number of lines added
+    """
+    size = os.path.getsize(path)
+    found = db.execute('SELECT offset FROM sources WHERE robot = ? AND path = ?',
+                       (robot, path)).fetchone()
+    offset = found[0] if found and found[0] <= size else 0
+    count = 0
+    end = [offset]
+    with open(path, 'rb') as f:
+        f.seek(offset)
+
+        def complete_lines():
+            for line in f:
+                if not line.endswith('\n'):
+                    break  # still being written, ingested next time
+                end[0] += len(line)
+                yield line
+
+        batch = list()
+        for row in parse_lines(complete_lines()):
+            batch.append([robot] + row)
+            if len(batch) >= BATCH:
+                db.executemany('INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?)', batch)
+                count += len(batch)
+                batch = list()
+        db.executemany('INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?)', batch)
+        count += len(batch)
+    db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', (robot, path, end[0]))
+    db.commit()
+    return count
+
+
+def query(db, robots=None, level=None, category=None, since=None, until=None,
+          grep=None, limit=None):
+    """Return the archived lines matching every given criterion, oldest first.
+    :param robots: list of robot names
+    :param level: this level and the more severe ones, e.g. 'E'
+    :param category: regular expression searched in the category, e.g.
+    'ALBehaviorManager|ALServiceManager'
+    :param since, until: epoch seconds
+    :param grep: substring of the message
+    :return: list of (robot, time, level, thread, category, message)
+    """
+    where, params = list(), list()
+    if robots:
+        where.append('robot IN ({})'.format(', '.join('?' * len(robots))))
+        params.extend(robots)
+    if level:
+        levels = logs.LEVELS[:logs.level_rank(level.upper()[0]) + 1]
+        where.append('level IN ({})'.format(', '.join('?' * len(levels))))
+        params.extend(levels)
+    if category:
+        where.append('category REGEXP ?')
+        params.append(category)
+    if since is not None:
+        where.append('time >= ?')
+        params.append(since)
+    if until is not None:
+        where.append('time < ?')
+        params.append(until)
+    if grep:
+        where.append("message LIKE ? ESCAPE '\\'")
+        params.append('%' + grep.replace('\\', '\\\\').replace('%', '\\%')
+                      .replace('_', '\\_') + '%')
+    sql = 'SELECT * FROM lines'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY time'
+    if limit:
+        sql += ' LIMIT {:d}'.format(limit)
+    return db.execute(sql, params).fetchall()
@@ -0,0 +1,137 @@
+"""
+cache.py
+
+a local store of built packages keyed by a hash of the project tree, so
+unchanged projects are not packaged twice.
+
+Builds live in <cache_path>/<uuid>/<tree hash>/<uuid>.pkg and the last
+cache_size builds of each uuid are kept, least recently used first out.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import config
+import ignore
+import packager
+import sync
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.qidev_cache')
+DEFAULT_SIZE = 5
+
+
+def cache_path():
+    """Return the root directory of the cache (config field cache_path)."""
+    path = config.read_field('cache_path')
+    return os.path.expanduser(path) if path else DEFAULT_PATH
+
+
+def cache_size():
+    """Return the number of builds kept per uuid (config field cache_size)."""
+    try:
+        return max(int(config.read_field('cache_size')), 1)
+    except (TypeError, ValueError):
+        return DEFAULT_SIZE
+
+
+def tree_hash(path, levels):
+    """Hash the relative paths and contents of every file under path,
+    manifest.xml included, along with how they are compressed: the levels by
+    extension (see packager.compression_levels) and packager.POLICY_VERSION."""
+    sha = hashlib.sha1()
+    sha.update('{}\0{}\n'.format(packager.POLICY_VERSION, json.dumps(levels, sort_keys=True)))
+    for rel_path, digest in sorted(sync.local_digests(path).iteritems()):
+        sha.update('{}\0{}\n'.format(rel_path, digest))
+    return sha.hexdigest()
+
+
+def list_builds(uuid):
+    """Return the cached builds of uuid, most recently used first.
+    :return: list of (tree hash, absolute path of the .pkg, last use time)
+    """
+    uuid_dir = os.path.join(cache_path(), uuid)
+    if not os.path.isdir(uuid_dir):
+        return list()
+    builds = list()
+    for key in os.listdir(uuid_dir):
+        pkg = os.path.join(uuid_dir, key, uuid + '.pkg')
+        if os.path.exists(pkg):
+            builds.append((key, pkg, os.path.getmtime(pkg)))
+    return sorted(builds, key=lambda b: b[2], reverse=True)
+
+
+def list_uuids():
+    """Return the uuids that have cached builds."""
+    root = cache_path()
+    if not os.path.isdir(root):
+        return list()
+    return sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+
+def find_build(uuid, prefix):
+    """Return the path of the cached build of uuid whose tree hash starts
+    with prefix, or None."""
+    matches = [pkg for key, pkg, _ in list_builds(uuid) if key.startswith(prefix)]
+    if len(matches) != 1:
+        return None
+    touch(matches[0])
+    return matches[0]
+
+
+def touch(pkg):
+    """Mark a build as used now."""
+    now = time.time()
+    os.utime(pkg, (now, now))
+
+
+def evict(uuid, keep):
+    """Remove all but the keep most recently used builds of uuid."""
+    for key, pkg, _ in list_builds(uuid)[keep:]:
+        shutil.rmtree(os.path.dirname(pkg), ignore_errors=True)
+
+
+def get_package(pkg_path, uuid, verb, verbose=False):
+    """Return the path of the package built from pkg_path, building it only if
+    this tree was not built before.
+    :param pkg_path: absolute path to the project directory
+    :param uuid: uuid of the package, from the manifest
+    :param verbose: also report the size of the excluded directories, which
+    takes a walk of each of them
+    """
+    levels = packager.compression_levels()
+    key = tree_hash(pkg_path, levels)
+    build_dir = os.path.join(cache_path(), uuid, key)
+    pkg = os.path.join(build_dir, uuid + '.pkg')
+    if os.path.exists(pkg):
+        verb('Reuse cached build {}'.format(key))
+        touch(pkg)
+        return pkg
+    verb('Build {} into cache'.format(key))
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+    # build next to the destination and rename so a killed build is never reused
+    fd, tmp = tempfile.mkstemp(suffix='.pkg', dir=build_dir)
+    os.close(fd)
+    excluded, stats = list(), dict()
+    try:
+        packager.build(pkg_path, tmp, excluded=excluded, stats=stats, levels=levels)
+        os.rename(tmp, pkg)
+    except:
+        os.remove(tmp)
+        raise
+    if verbose:
+        sizes = [size for _, size in excluded if size is not None]
+        dirs = [p for p, size in excluded if size is None]
+        verb('Excluded {} files ({:.1f} MB) and {} directories ({:.1f} MB) matching {}'.format(
+            len(sizes), sum(sizes) / 1048576.0, len(dirs),
+            sum(packager.tree_size(d) for d in dirs) / 1048576.0, ignore.IGNORE_FILE))
+    for ext, (files, size, compressed, seconds) in sorted(
+            stats.iteritems(), key=lambda s: s[1][3], reverse=True):
+        verb('Compressed {} {} files: {:.1f} MB to {:.0%} in {:.2f} s'.format(
+            files, '.' + ext if ext else 'extensionless', size / 1048576.0,
+            float(compressed) / size if size else 1, seconds))
+    evict(uuid, cache_size())
+    return pkg
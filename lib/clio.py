@@ -7,14 +7,10 @@ functions for command line input/output.
 from clint.textui import colored as col
 from clint.textui import puts, indent
 from tabulate import tabulate
-import readline
-readline.set_completer_delims('')
-if 'libedit' in readline.__doc__:
-    readline.parse_and_bind("bind ^I rl_complete")
-else:
-    readline.parse_and_bind("tab: complete")
 import sys
 import socket
+import time
+import bisect
 
 
 def bold(text):
@@ -26,8 +22,21 @@ def underlined(text):
 
 
 def create_completer(completions):
+    """Return a readline completer over completions. Matches for a prefix are
+    found once by bisecting the sorted completions; readline then asks for them
+    one state at a time, which is served from that result."""
+    names = sorted(set(completions))
+    last = {'text': None, 'options': []}
+
     def completer(text, state):
-        options = [i for i in completions if i.startswith(text)]
+        if state == 0 or text != last['text']:
+            options = list()
+            for i in xrange(bisect.bisect_left(names, text), len(names)):
+                if not names[i].startswith(text):
+                    break
+                options.append(names[i])
+            last['text'], last['options'] = text, options
+        options = last['options']
         if state < len(options):
             return options[state]
         else:
@@ -39,53 +48,74 @@ def show_info(conn):
     socket.setdefaulttimeout(3)
     (hn, _, ips) = socket.gethostbyname_ex(conn.hostname)
     ip = ips[0]
+    info = conn.get_info()
     print('')
     print('{}: {}'.format(bold('Robot'),
-                          col.magenta(conn.get_robot_name())))
+                          col.magenta(info['name'])))
     if '.local' in hn:
         print('{}: {}'.format(bold('Hostname'),
                               col.blue(hn)))
     print('{}: {}'.format(bold('IP'),
                           col.blue(ip)))
-    system = conn.session.service('ALSystem')
     print('{}: {}'.format(bold('NaoQi Version'),
-                          system.systemVersion()))
-    tts = conn.session.service('ALTextToSpeech')
-    lang = tts.getLanguage()
-    al = tts.getAvailableLanguages()
-    al = ['{}'.format(col.green(l.upper())) if l == lang else l for l in al]
+                          info['version']))
+    lang = info['language']
+    al = ['{}'.format(col.green(l.upper())) if l == lang else l for l in info['languages']]
     available_langs = ', '.join(al)
     print('{}: {}'.format(bold('Languages'),
                           available_langs))
-    audio = conn.session.service('ALAudioDevice')
     print('{}: {}'.format(bold('Volume'),
-                          audio.getOutputVolume()))
-    posture = conn.session.service('ALRobotPosture')
-    post = posture.getPosture()
-    fam = posture.getPostureFamily()
+                          info['volume']))
     print('{}: {} ({})'.format(bold('Posture'),
-                               post,
-                               fam))
-    life = conn.session.service('ALAutonomousLife')
-    fact = life.focusedActivity()
+                               info['posture'],
+                               info['posture_family']))
+    fact = info['focused_activity']
     if not fact:
         fact = 'none'
     else:
         fact = col.red(fact)
     print('{}: {}'.format(bold('Focused Activity'),
                           fact))
-    state = life.getState().upper()
-    if state == 'SOLITARY':
-        state = col.green(state)
-    elif state == 'DISABLED':
-        state = col.yellow(state)
-    else:
-        state = col.red(state)
     print('{}: {}'.format(bold('ALife State'),
-                          state))
+                          color_life_state(info['life_state'])))
     print('')
 
 
+def show_fleet_info(rows):
+    """Pretty-print one line of state per robot.
+    :param rows: list of (hostname, info dict or None, error or None)
+    """
+    table = list()
+    for hostname, info, error in rows:
+        if error is not None:
+            table.append([col.magenta(hostname), '', '', '', '', '', '',
+                          col.red(str(error) or type(error).__name__)])
+            continue
+        table.append([col.magenta(hostname),
+                      info['name'],
+                      info['version'],
+                      info['volume'],
+                      '{} ({})'.format(info['posture'], info['posture_family']),
+                      info['focused_activity'] or 'none',
+                      color_life_state(info['life_state']),
+                      '{:.0f} ms'.format(info['latency'] * 1000)])
+    print('')
+    print tabulate(table,
+                   headers=['Robot', 'Name', 'NaoQi Version', 'Volume', 'Posture',
+                            'Focused Activity', 'ALife State', 'RPC Latency'],
+                   tablefmt='orgtbl')
+    print('')
+
+
+def color_life_state(state):
+    state = state.upper()
+    if state == 'SOLITARY':
+        return col.green(state)
+    elif state == 'DISABLED':
+        return col.yellow(state)
+    return col.red(state)
+
+
 def show_installed_packages(verb, pkgs):
     """Pretty-print a table of installed packages."""
     table = list()
@@ -122,9 +152,131 @@ def show_installed_services(verb, pkgs):
     print('')
 
 
+def show_cached_builds(builds):
+    """Pretty-print a table of cached package builds.
+    :param builds: list of [uuid, tree hash, size in bytes, last use time]
+    """
+    table = list()
+    for uuid, key, size, used in builds:
+        table.append([bold(uuid),
+                      key,
+                      '{:.1f} MB'.format(size / 1048576.0),
+                      time.strftime('%Y-%m-%d %H:%M', time.localtime(used))])
+    print('')
+    print tabulate(table,
+                   headers=['Unique ID', 'Build', 'Size', 'Last Used'],
+                   tablefmt='orgtbl')
+    print('')
+
+
+def rate(size, seconds):
+    """Format a throughput in MB/s."""
+    return '{:.1f} MB/s'.format(size / 1048576.0 / seconds if seconds > 0 else 0)
+
+
+def progress_bar(label, interval=0.2):
+    """Return a progress function of (bytes done, total bytes) redrawing one
+    line with the percentage and the throughput at most every interval seconds.
+    Nothing is drawn if stdout is not a terminal."""
+    state = {'start': time.time(), 'drawn': 0}
+
+    def progress(done, total):
+        now = time.time()
+        if not sys.stdout.isatty() or (now - state['drawn'] < interval and done < total):
+            return
+        state['drawn'] = now
+        sys.stdout.write('\r{} {:3.0f}% {:.1f}/{:.1f} MB {}'.format(
+            label, 100.0 * done / total, done / 1048576.0, total / 1048576.0,
+            rate(done, now - state['start'])))
+        if done >= total:
+            sys.stdout.write('\n')
+        sys.stdout.flush()
+    return progress
+
+
+def show_groups(groups, tags):
+    """Pretty-print the groups and the tags of the robots.
+    :param groups: dict of group name to hostnames
+    :param tags: dict of hostname to tag names
+    """
+    table = list()
+    for name in sorted(groups):
+        table.append([bold(name), 'group', ' '.join(col.magenta(h) for h in groups[name])])
+    for host in sorted(tags):
+        table.append([col.magenta(host), 'tags', ' '.join(col.blue(t) for t in tags[host])])
+    print('')
+    print tabulate(table, headers=['Name', 'Kind', 'Robots/Tags'], tablefmt='orgtbl')
+    print('')
+
+
+def show_install_summary(results):
+    """Pretty-print the stage timings of a fleet install.
+    :param results: list of fleet.Result whose values are dicts of stage to seconds
+    """
+    def seconds(t):
+        return '{:.1f}s'.format(t) if t is not None else '-'
+
+    table = list()
+    for r in results:
+        timings = r.value or dict()
+        table.append([col.magenta(r.host),
+                      seconds(r.timings.get('connect')),
+                      seconds(timings.get('upload')),
+                      rate(*timings['rate']) if timings.get('rate') else '-',
+                      seconds(timings.get('install')),
+                      fleet_status(r)])
+    print('')
+    print tabulate(table,
+                   headers=['Robot', 'Connect', 'Upload', 'Throughput', 'Install', 'Status'],
+                   tablefmt='orgtbl')
+    print('')
+
+
+def fleet_status(result):
+    if result.ok:
+        return col.green('ok')
+    return col.red(str(result.error) or type(result.error).__name__)
+
+
+def show_fleet_summary(results):
+    """Pretty-print the outcome of an operation on every robot, in order.
+    :param results: list of fleet.Result
+    """
+    def seconds(t):
+        return '{:.1f}s'.format(t) if t is not None else '-'
+
+    table = list()
+    for r in results:
+        table.append([col.magenta(r.host),
+                      r.attempts,
+                      seconds(r.timings.get('connect')),
+                      seconds(r.timings.get('operation')),
+                      fleet_status(r)])
+    failed = len([r for r in results if not r.ok])
+    print('')
+    print tabulate(table,
+                   headers=['Robot', 'Attempts', 'Connect', 'Operation', 'Status'],
+                   tablefmt='orgtbl')
+    if failed:
+        print('{}: failed on {} of {} robots'.format(col.red('error'), failed, len(results)))
+    print('')
+
+
+def _readline():
+    """Import and configure readline on first use; only prompts need it."""
+    import readline
+    if readline.get_completer_delims():
+        readline.set_completer_delims('')
+        if 'libedit' in readline.__doc__:
+            readline.parse_and_bind("bind ^I rl_complete")
+        else:
+            readline.parse_and_bind("tab: complete")
+    return readline
+
+
 def _prompt(prompt_text, completions):
     """Prompt the user with tab completions."""
-    readline.set_completer(create_completer(completions))
+    _readline().set_completer(create_completer(completions))
     try:
         inp = raw_input(prompt_text + ' (tab to complete) \n> ')
         return inp
@@ -185,48 +337,51 @@ def put_service_string(s):
 
 
 def show_package_details(package, pkgs):
-    """Pretty-print the details of an installed package."""
+    """Pretty-print the details of an installed package.
+    :param package: uuid or name of the package
+    :param pkgs: PackageSet of the installed packages
+    """
     print('')
-    for p in pkgs:
-        if p.name == package or p.uuid == package:
-            print('* {} ({})'.format(bold(p.name),
-                                     col.cyan('v' + p.version)))
-            with indent(2):
-                puts(pretty('UUID') + p.uuid)
-                try:
-                    mn, mx = p.naoqi_min, p.naoqi_max
-                    if not mn:
-                        mn = '0.0.0'
-                    if not mx:
-                        mx = 'INF'
-                    puts(pretty('NaoQi Requirements') + '{} <= version <= {}'
-                         .format(mn, mx))
-                except IndexError:
-                    pass
-                try:
-                    puts(pretty('Supported Languages') +
-                         pretty(p.supported_langs))
-                except AttributeError:
-                    pass
-                try:
-                    max_len = 200
-                    if len(p.description) > max_len:
-                        puts(pretty('Desciption') + '{}...'
-                             .format(p.description[:max_len]))
-                    else:
-                        puts(pretty('Desciption') + '{}'.format(p.description))
-                except KeyError:
-                    pass
-                if p.behaviors:
-                    puts(pretty('Behaviors ({})'.format(len(p.behaviors))))
-                    with indent(2):
-                        for b in p.behaviors:
-                            put_behavior_string(b)
-                if p.services:
-                    puts(pretty('Services ({})'.format(len(p.services))))
-                    with indent(2):
-                        for s in p.services:
-                            put_service_string(s)
+    p = pkgs.get(package)
+    if p:
+        print('* {} ({})'.format(bold(p.name),
+                                 col.cyan('v' + p.version)))
+        with indent(2):
+            puts(pretty('UUID') + p.uuid)
+            try:
+                mn, mx = p.naoqi_min, p.naoqi_max
+                if not mn:
+                    mn = '0.0.0'
+                if not mx:
+                    mx = 'INF'
+                puts(pretty('NaoQi Requirements') + '{} <= version <= {}'
+                     .format(mn, mx))
+            except IndexError:
+                pass
+            try:
+                puts(pretty('Supported Languages') +
+                     pretty(p.supported_langs))
+            except AttributeError:
+                pass
+            try:
+                max_len = 200
+                if len(p.description) > max_len:
+                    puts(pretty('Desciption') + '{}...'
+                         .format(p.description[:max_len]))
+                else:
+                    puts(pretty('Desciption') + '{}'.format(p.description))
+            except KeyError:
+                pass
+            if p.behaviors:
+                puts(pretty('Behaviors ({})'.format(len(p.behaviors))))
+                with indent(2):
+                    for b in p.behaviors:
+                        put_behavior_string(b)
+            if p.services:
+                puts(pretty('Services ({})'.format(len(p.services))))
+                with indent(2):
+                    for s in p.services:
+                        put_service_string(s)
     print('')
 
 
@@ -265,7 +420,22 @@ def show_dialog_output(value):
     print(col.red(value.strip().rjust(60)))
 
 
-def format_nao_output(file_like, command):
+def show_archived_logs(rows):
+    """Print archived log lines, prefixed with their robot.
+    :param rows: list of (robot, time, level, thread, category, message)
+    """
+    width = max([len(r[0]) for r in rows] or [0])
+    for robot, t, level, thread, category, message in rows:
+        line = '[{}] {:.6f} {} {}: {}'.format(level, t, thread, category, message)
+        print('{} {}'.format(col.magenta(robot.ljust(width)),
+                             col.red(line) if level in 'FE' else
+                             col.yellow(line) if level == 'W' else line))
+
+
+def format_nao_output(file_like, command, tag=None):
+    """Print the output of the naoqi init script until command is done.
+    :param tag: robot name prefixing every line, when several robots print
+    """
     done = False
     for line in file_like:
         if (command == 'restart' or command == 'start') and 'Starting naoqi' in line:
@@ -275,7 +445,10 @@ def format_nao_output(file_like, command):
         line = line.replace('Stopping', str(col.red('Stopping')))
         line = line.replace('Starting', str(col.green('Starting')))
         line = line.replace('waiting', str(col.yellow('waiting')))
-        print line.rstrip()
+        if tag:
+            print('{} {}'.format(col.magenta(tag), line.rstrip()))
+        else:
+            print line.rstrip()
         if done:
             break
     file_like.close()
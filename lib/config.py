@@ -2,42 +2,107 @@
 config.py
 
 functions for reading and writing configurations to JSON file .qidev
+
+The file is parsed once per process and parsed again only when its mtime
+changes. Writes take an exclusive lock on .qidev.lock, apply the change to the
+file as it is on disk and replace it atomically, so concurrent qidev processes
+do not lose or corrupt each other's fields.
+
+Fields may be nested in sections with dotted names, e.g. 'groups.lab', or with
+a list of keys when a key contains dots, e.g. ['tags', 'Michelangelo.local'].
 """
 
 import os
 import json
+import fcntl
+import threading
 
 path = os.path.join(os.path.expanduser('~'), '.qidev')
 
+_data = None
+_stamp = None  # (mtime, size) of the file _data was parsed from
+_lock = threading.Lock()
+
+
+def _stat():
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _parse():
+    try:
+        with open(path, 'r') as json_file:
+            data = json.load(json_file)
+    except IOError:
+        return dict()
+    except ValueError as e:
+        raise RuntimeError('{} is not valid JSON: {}'.format(path, e))
+    if not isinstance(data, dict):
+        raise RuntimeError('{} does not hold a JSON object'.format(path))
+    return data
+
+
+def _keys(field):
+    return field.split('.') if isinstance(field, basestring) else list(field)
+
+
+def load():
+    """Return the whole configuration, parsing the file only if it changed
+    since it was last parsed. The returned dict must not be modified."""
+    global _data, _stamp
+    stamp = _stat()
+    with _lock:
+        if _data is None or stamp != _stamp:
+            _data = _parse() if stamp else dict()
+            _stamp = stamp
+        return _data
+
 
 def read_field(field):
     """Read the .qidev JSON file.
-    :param field: (str) the field to read from the config file
-    :return: the value of the field
+    :param field: (str) the field to read from the config file, sections
+    separated by dots, or a list of keys
+    :return: the value of the field, None if it is not set
     """
-    if not os.path.exists(path):
-        return None
-    else:
-        with open(path, 'r') as json_file:
-            try:
-                data = json.load(json_file)
-                return data[field]
-            except:
-                return None
+    value = load()
+    for key in _keys(field):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
 
 
 def write_field(field, value):
     """Write a field to the .qidev JSON file.
-    :param field: (str) the field to write
-    :param value: (str) the value of that field
+    :param field: (str) the field to write, sections separated by dots, or a
+    list of keys; missing sections are created
+    :param value: (str) the value of that field, None removes the field
     """
-    if not os.path.exists(path):
-        with open(path, 'w+') as json_file:
-            data = {field: value}
-            json.dump(data, json_file)
-    else:
-        with open(path, 'r') as json_file:
-            data = json.load(json_file)
-        with open(path, 'w+') as json_file:
-            data[field] = value
-            json.dump(data, json_file)
+    global _data, _stamp
+    with _lock, open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data = _parse()  # another process may have written since we read it
+        keys = _keys(field)
+        section = data
+        for key in keys[:-1]:
+            if not isinstance(section.get(key), dict):
+                section[key] = dict()
+            section = section[key]
+        if value is None:
+            section.pop(keys[-1], None)
+        else:
+            section[keys[-1]] = value
+        tmp = path + '.tmp'  # no other writer while we hold the lock
+        try:
+            with open(tmp, 'w') as json_file:
+                json.dump(data, json_file, indent=2, sort_keys=True)
+                json_file.flush()
+                os.fsync(json_file.fileno())
+            os.rename(tmp, path)
+        except:
+            os.remove(tmp)
+            raise
+        _data, _stamp = data, _stat()
@@ -7,17 +7,34 @@ A Connection object manages all remote communication via SSH and qi Session.
 
 import qi
 import os
-import paramiko
-from scp import SCPClient, SCPException
-import xml.etree.ElementTree as ET
-import zipfile
+import json
+import time
+import pipes
+import posixpath
+import shutil
+import tempfile
 import clio as io
 import config
+import cache
 from clint.textui import colored as col
 import package_utils as pu
+import inventory
+import groups
+import packager
+import sync
+import transfer as tf
 import socket
+from threading import Thread, Lock
 qi.logging.setLevel(0)
 
+PROBE_TIMEOUT = 1  # seconds to wait for the SSH port before assuming a virtual robot
+QI_TIMEOUT = 5
+SSH_TIMEOUT = 5
+
+_virtual_hosts = dict()  # hostname -> bool, see is_virtual
+_ssh_hosts = None  # hostname -> time its SSH port answered, loaded on first use
+_ssh_hosts_lock = Lock()
+
 
 class Connection():
     """Establish a connection to ip/hostname and a qi session."""
@@ -28,8 +45,8 @@ class Connection():
                  port='9559',
                  username='nao',
                  password='nao',
-                 ssh=True,  # create SSH tunnel?
-                 qi_session=True):  # create qi session?
+                 ssh=True,  # create SSH tunnel now? (else on first use)
+                 qi_session=True):  # create qi session now? (else on first use)
         self.verb = verb
         if not hostname:
             try:
@@ -39,116 +56,315 @@ class Connection():
                                    col.red('ERROR'))
         else:
             self.hostname = hostname
+        # hostname identifies the robot, address is what we connect to
+        self.address = groups.address(self.hostname)
+        self._address_lock = Lock()
+        self._looked_up = set()  # addresses that failed and were looked up again
         verb('Connect to {}'.format(self.hostname))
         self.user = username
         self.pw = password
-        self.virtual = False
-        self.ssh = None
-        self.scp = None
-        if qi_session:
-            verb('Create qi session')
-            try:
-                self.session = qi.Session()
-                self.session.connect(self.hostname)
-            except RuntimeError:
-                raise RuntimeError('%s: could not establish connection to %s' %
-                                   (col.red('ERROR'), col.blue(self.hostname)))
-        else:
-            self.session = None
+        self._session = None
+        self._services = dict()
+        self._ssh = None
+        self._scp = None
+        self._ssh_error = None
+        self._ssh_thread = None
+        self.last_upload = None  # (bytes, seconds) of the last transfer
         if ssh:
-            verb('Establish connection via SSH')
-            try:
-                self.ssh = paramiko.SSHClient()
-                self.ssh.load_system_host_keys()
-                # accept unknown keys
-                self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                self.ssh.connect(self.hostname,
-                                 # port=self.port,
-                                 username=self.user,
-                                 password=self.pw,
-                                 allow_agent=False,
-                                 look_for_keys=False)  # have pw, don't look for private keys
-                self.scp = SCPClient(self.ssh.get_transport())
-            except socket.gaierror as e:
-                raise RuntimeError('{}: {} ... for hostname: {}'.format(col.red('ERROR'), e,
-                                                                        col.blue(self.hostname)))
-            except socket.error as e:
-                verb('Virtual robot detected')
-                self.virtual = True  # assuming this is a virtual bot... kind of a hack?
-        if self.virtual:
-            self.install_path = os.path.expanduser('~')
-        else:
-            self.install_path = '/home/nao/'  # always linux
-        self.install_path = os.path.join(self.install_path,
-                                         '.local', 'share', 'PackageManager', 'apps')
+            # probe and open SSH in the background while the qi session
+            # connects; the ssh property waits for it on first use
+            self._ssh_thread = Thread(target=self._start_ssh)
+            self._ssh_thread.daemon = True
+            self._ssh_thread.start()
+        if qi_session:
+            self._open_session()
+
+    @property
+    def virtual(self):
+        """Is the robot virtual (naoqi running on this machine)?"""
+        address = self.address
+        if is_virtual(address):  # or a real robot that moved
+            self._readdress(address)
+        return is_virtual(self.address)
+
+    def _readdress(self, failed):
+        """Look the hostname up again after connecting to the address failed,
+        which may be stale (a new DHCP lease).
+        :return: True if self.address changed and connecting is worth retrying
+        """
+        if failed == self.hostname:  # not looked up, nothing cached
+            return False
+        with self._address_lock:
+            if self.address != failed:  # already looked up by the other thread
+                return True
+            if failed in self._looked_up:
+                return False
+            self._looked_up.add(failed)
+            address = groups.readdress(self.hostname)
+            if address == failed:
+                return False
+            self.verb('{} moved from {} to {}'.format(self.hostname, failed, address))
+            forget_host(failed)
+            self.address = address
+            return True
+
+    @property
+    def install_path(self):
+        """Where PackageManager keeps installed apps on the robot."""
+        home = os.path.expanduser('~') if self.virtual else '/home/nao/'  # always linux
+        return os.path.join(home, '.local', 'share', 'PackageManager', 'apps')
 
-    def transfer(self, pkg_absolute_path):
-        """Transfer the package to the remote filesystem.
+    def _open_session(self):
+        self.verb('Create qi session')
+        address = self.address
+        try:
+            self._session = qi.Session()
+            self._session.connect(address, _async=True).value(QI_TIMEOUT * 1000)
+        except RuntimeError:
+            self._session = None
+            if self._readdress(address):
+                return self._open_session()
+            raise RuntimeError('%s: could not establish connection to %s' %
+                               (col.red('ERROR'), col.blue(self.hostname)))
+
+    @property
+    def session(self):
+        """The qi session, connected on first use if it was not at creation."""
+        if not self._session:
+            self._open_session()
+        return self._session
+
+    def _start_ssh(self):
+        """Open SSH unless the robot is virtual."""
+        try:
+            if self.virtual:
+                return
+        except RuntimeError as e:  # the hostname does not resolve
+            self._ssh_error = e
+            return
+        self.verb('Establish connection via SSH')
+        self._open_ssh()
+
+    def _open_ssh(self):
+        """Connect the SSH client; errors are raised by the ssh property."""
+        # paramiko is slow to import, only load it for commands that use SSH
+        import paramiko
+        address = self.address
+        try:
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()
+            # accept unknown keys
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            client.connect(address,
+                           # port=self.port,
+                           username=self.user,
+                           password=self.pw,
+                           timeout=SSH_TIMEOUT,
+                           allow_agent=False,
+                           look_for_keys=False)  # have pw, don't look for private keys
+            self._ssh = client
+        except (socket.error, paramiko.SSHException) as e:
+            if isinstance(e, socket.error) and self._readdress(address):
+                return self._open_ssh()
+            self._ssh_error = RuntimeError('{}: SSH connection to {} failed: {}'.format(
+                col.red('ERROR'), col.blue(self.hostname), e))
+
+    @property
+    def ssh(self):
+        """The paramiko SSHClient, connected on first use (None on a virtual robot)."""
+        if self._ssh_thread:
+            self._ssh_thread.join()
+            self._ssh_thread = None
+        if self.virtual:
+            return None
+        if not self._ssh and not self._ssh_error:
+            self.verb('Establish connection via SSH')
+            self._open_ssh()
+        if self._ssh_error:
+            raise self._ssh_error
+        return self._ssh
+
+    def transport(self):
+        """Return the active SSH transport, reconnecting if the connection was
+        closed or could not be opened."""
+        try:
+            transport = self.ssh.get_transport()
+        except RuntimeError:  # SSH could not be opened, try again
+            transport = None
+        if not transport or not transport.is_active():
+            self.verb('Reconnect to {} via SSH'.format(self.hostname))
+            if self._ssh:
+                self._ssh.close()
+            self._ssh = self._scp = self._ssh_error = None
+            transport = self.ssh.get_transport()
+        return transport
+
+    @property
+    def scp(self):
+        """The SCPClient over the SSH transport, created on first use."""
+        if not self._scp and self.ssh:
+            from scp import SCPClient
+            self._scp = SCPClient(self.ssh.get_transport())
+        return self._scp
+
+    def service(self, name):
+        """Return the proxy of a qi service, resolved once per Connection."""
+        if name not in self._services:
+            self._services[name] = self.session.service(name)
+        return self._services[name]
+
+    def gather(self, calls, timeout=QI_TIMEOUT):
+        """Issue qi calls as futures and wait for all of them, so N calls cost
+        one round trip instead of N.
+        :param calls: list of (service name, method name, args tuple)
+        :param timeout: seconds to wait for each result
+        :return: the results in the order of calls
+        """
+        futures = [getattr(self.service(name), method)(*args, _async=True)
+                   for name, method, args in calls]
+        return [f.value(int(timeout * 1000)) for f in futures]
+
+    def close(self):
+        """Close the SSH client and the qi session."""
+        if self._ssh_thread:
+            self._ssh_thread.join()
+        if self._ssh:
+            self._ssh.close()
+        self._services.clear()
+        if self._session:
+            self._session.close()
+
+    def transfer(self, pkg_absolute_path, progress=None):
+        """Transfer the package to the remote filesystem over pipelined SFTP. An
+        interrupted transfer of the same package is resumed, and the package is
+        only put in place once its checksum matched on the robot.
         :param pkg_absolute_path: absolute path of the .pkg file.
+        :param progress: function of (bytes sent, total bytes), see transfer.upload
         """
         pkg = pkg_absolute_path.split(os.sep)[-1]
         if not self.virtual:
             remote_path = os.path.join(self.install_path, pkg)
-            self.scp.put(pkg_absolute_path, remote_path)
+            self.last_upload = tf.upload(self.hostname, self.transport, pkg_absolute_path,
+                                         remote_path, progress=progress)
+            self.verb('Uploaded {} bytes to {} ({})'.format(
+                self.last_upload[0], self.hostname, io.rate(*self.last_upload)))
         return pkg
 
     def remote_get(self, file_absolute_path, local_path=None):
         """Grab a file from the remote host."""
+        from scp import SCPException
         try:
             self.scp.get(file_absolute_path, local_path=local_path)
         except SCPException:
             raise RuntimeError
 
     def delete_pkg_file(self, abs_path):
-        """Remove pkg from apps/ on robot or abs_path on local machine.
-        :param pkg: the name of the package, e.g. my-package.pkg
+        """Remove pkg from apps/ on robot. A virtual robot installs straight from
+        the local build cache, so there is nothing to remove.
         :param abs_path: the absolute path of the package on the local machine.
         """
+        if self.virtual:
+            return
         pkg = abs_path.split(os.sep)[-1]
-        if self.virtual:  # delete the file from the local machine
-            os.remove(abs_path)
-        else:  # delete the file on the remote machine
-            remote_path_to_pkg = os.path.join(self.install_path, pkg)
-            sftp = self.ssh.open_sftp()
-            sftp.remove(remote_path_to_pkg)
-            sftp.close()
-
-    def get_package_uid(self, path):
+        remote_path_to_pkg = os.path.join(self.install_path, pkg)
+        sftp = self.ssh.open_sftp()
+        sftp.remove(remote_path_to_pkg)
+        sftp.close()
+
+    def get_remote_digests(self, uuid):
+        """Hash the files of an installed app on the remote host.
+        :param uuid: the uuid of the installed package
+        :return: dict of relative path to md5 hex digest, empty if not installed.
+        """
+        app_path = os.path.join(self.install_path, uuid)
+        if self.virtual:
+            if not os.path.isdir(app_path):
+                return dict()
+            return sync.local_digests(app_path)
+        command = 'cd {} 2>/dev/null && find . -type f -exec md5sum {{}} +'.format(
+            pipes.quote(app_path))
+        self.verb(command)
+        sshin, sshout, ssherr = self.ssh.exec_command(command)
+        digests = sync.parse_md5sum(sshout)
+        sshout.close()
+        return digests
+
+    def push_files(self, local_root, uuid, rel_paths):
+        """Copy files from a project directory into an installed app.
+        :param local_root: absolute path of the project directory
+        :param uuid: the uuid of the installed package
+        :param rel_paths: '/' separated paths relative to local_root
+        """
+        app_path = os.path.join(self.install_path, uuid)
+        if self.virtual:
+            for rel_path in rel_paths:
+                dest = os.path.join(app_path, *rel_path.split('/'))
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                shutil.copy2(os.path.join(local_root, *rel_path.split('/')), dest)
+            return
+        sftp = self.ssh.open_sftp()
+        existing = set()
+        for rel_path in rel_paths:
+            remote_path = posixpath.join(app_path, rel_path)
+            sftp_makedirs(sftp, posixpath.dirname(remote_path), existing)
+            sftp.put(os.path.join(local_root, *rel_path.split('/')), remote_path)
+        sftp.close()
+
+    def remove_files(self, uuid, rel_paths):
+        """Remove files from an installed app.
+        :param uuid: the uuid of the installed package
+        :param rel_paths: '/' separated paths relative to the app directory
+        """
+        app_path = os.path.join(self.install_path, uuid)
+        if self.virtual:
+            for rel_path in rel_paths:
+                os.remove(os.path.join(app_path, *rel_path.split('/')))
+            return
+        sftp = self.ssh.open_sftp()
+        for rel_path in rel_paths:
+            sftp.remove(posixpath.join(app_path, rel_path))
+        sftp.close()
+
+    def sync_package(self, pkg_path):
+        """Push only the files of pkg_path that differ from the installed app.
+        :param pkg_path: absolute path to the project directory
+        :return: (changed, deleted) lists of relative paths, or None when the
+        package must be fully reinstalled (not installed or manifest changed).
+        """
+        uuid = self.get_package_uid(pkg_path)
+        local = sync.local_digests(pkg_path)
+        remote = self.get_remote_digests(uuid)
+        if sync.needs_reinstall(local, remote):
+            return None
+        changed, deleted = sync.diff(local, remote)
+        self.verb('{} changed, {} deleted'.format(len(changed), len(deleted)))
+        if changed:
+            self.push_files(pkg_path, uuid, changed)
+        if deleted:
+            self.remove_files(uuid, deleted)
+        if changed or deleted:  # behavior metadata may have changed
+            inventory.invalidate(self.hostname)
+        return changed, deleted
+
+    @staticmethod
+    def get_package_uid(path):
         """Get the UUID of the package locatated at path by parsing the manifest.
         :params path: absolute path to the package directory.
         :return: the UUID of package.
         """
-        with open(os.path.join(path, 'manifest.xml'), 'r') as manifest:
-            xml = ET.fromstring(manifest.read())
-            try:
-                uid = xml.attrib['uuid']
-                return uid
-            except KeyError:
-                print 'no UUID found'
-                return None
-
-    def create_package(self, pkg_path=None):
-        """Create a package out of the contents of the current directory.
-        :return: the absolute path to the package on the local machine.
-        """
-        if not pkg_path:
-            pkg_path = os.getcwd()
-        pkg = self.get_package_uid(pkg_path) + '.pkg'
-        path = os.path.join(pkg_path, '..', pkg)
-        zipf = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
-        zip_dir(pkg_path, zipf)
-        zipf.close()
-        return path
+        return packager.get_package_uid(path)
 
     def install_package(self, abs_path):
         """Install package on system.
         abs_path (str): absolute path to the package.
         """
-        pacman = self.session.service('PackageManager')
+        pacman = self.service('PackageManager')
         pkg = abs_path.split(os.sep)[-1]
         uuid = pkg.replace('.pkg', '')
         if self.remove_package(uuid):
             self.verb('Removed previous package: {}'.format(uuid))
+        inventory.invalidate(self.hostname)
         if self.virtual:
             pacman.install(os.path.join(abs_path))
         else:
@@ -158,42 +374,56 @@ class Connection():
         """Remove a package from the robot via PackageManager.
         uuid (str): uuid of the package to remove
         """
-        pacman = self.session.service('PackageManager')
+        pacman = self.service('PackageManager')
         try:
             pacman.removePkg(uuid)
+            inventory.invalidate(self.hostname)
             return True
         except RuntimeError:
             return False
 
-    def get_installed_package_data(self, verb):
-        return pu.get_packages('en_US', verb, session=self.session)
+    def get_installed_package_data(self, verb, refresh=False):
+        """Return the installed packages as a PackageSet, from the inventory snapshot if it is
+        fresh (no round trip to the robot) or from PackageManager.
+        :param refresh: ignore the snapshot
+        """
+        packs = None if refresh else inventory.load(self.hostname)
+        if packs is not None:
+            verb('Use package inventory of {}'.format(self.hostname))
+        else:
+            api, packs = pu.fetch_packages(self.session, verb,
+                                           api=inventory.api(self.hostname))
+            inventory.save(self.hostname, api, packs)
+        return pu.PackageSet(pu.Package(d, 'en_US') for d in packs)
 
     def get_running_behaviors(self):
-        behman = self.session.service('ALBehaviorManager')
+        behman = self.service('ALBehaviorManager')
         return behman.getRunningBehaviors()
 
     def get_installed_behaviors(self):
-        behman = self.session.service('ALBehaviorManager')
+        behman = self.service('ALBehaviorManager')
         return behman.getInstalledBehaviors()
 
     def get_behavior_nature(self, b):
-        behman = self.session.service('ALBehaviorManager')
+        behman = self.service('ALBehaviorManager')
         return behman.getBehaviorNature(b)
 
     def get_running_services(self):
-        servman = self.session.service('ALServiceManager')
+        servman = self.service('ALServiceManager')
         # 'execStart': path to launcher
         # 'name': name
         # 'running': true or false
         services = [s['name'] for s in servman.services()]
-        return [s for s in services if servman.isServiceRunning(s)]
+        running = self.gather([('ALServiceManager', 'isServiceRunning', (s,))
+                               for s in services])
+        return [s for s, r in zip(services, running) if r]
 
     def get_declared_services(self):
-        servman = self.session.service('ALServiceManager')
+        servman = self.service('ALServiceManager')
         return [s['name'] for s in servman.services()]
 
     def start_behavior(self, behavior):
-        behman = self.session.service('ALBehaviorManager')
+        behman = self.service('ALBehaviorManager')
         try:
             behman.startBehavior(behavior)
             return True
@@ -201,7 +431,7 @@ class Connection():
             return False
 
     def stop_behavior(self, behavior):
-        behman = self.session.service('ALBehaviorManager')
+        behman = self.service('ALBehaviorManager')
         try:
             behman.stopBehavior(behavior)
             return True
@@ -209,7 +439,7 @@ class Connection():
             return False
 
     def life_switch_focus(self, activity):
-        life = self.session.service('ALAutonomousLife')
+        life = self.service('ALAutonomousLife')
         try:
             life.switchFocus(activity)
             return True
@@ -217,7 +447,7 @@ class Connection():
             return False
 
     def life_stop_focus(self):
-        life = self.session.service('ALAutonomousLife')
+        life = self.service('ALAutonomousLife')
         try:
             life.stopFocus()
             return True
@@ -226,35 +456,35 @@ class Connection():
         life.stopFocus()
 
     def get_focused_activity(self):
-        life = self.session.service('ALAutonomousLife')
+        life = self.service('ALAutonomousLife')
         return life.focusedActivity()
 
     def start_service(self, service):
-        servman = self.session.service('ALServiceManager')
+        servman = self.service('ALServiceManager')
         return servman.startService(service)
 
     def stop_service(self, service):
-        servman = self.session.service('ALServiceManager')
+        servman = self.service('ALServiceManager')
         return servman.stopService(service)
 
     def life_off(self):
-        life = self.session.service('ALAutonomousLife')
+        life = self.service('ALAutonomousLife')
         life.setState('disabled')
 
     def life_on(self):
-        life = self.session.service('ALAutonomousLife')
+        life = self.service('ALAutonomousLife')
         life.setState('solitary')
 
     def robot_reboot(self):
-        system = self.session.service('ALSystem')
+        system = self.service('ALSystem')
         system.reboot()
 
     def robot_shutdown(self):
-        system = self.session.service('ALSystem')
+        system = self.service('ALSystem')
         system.shutdown()
 
     def set_volume(self, level):
-        audio = self.session.service('ALAudioDevice')
+        audio = self.service('ALAudioDevice')
         curr_level = int(audio.getOutputVolume())
         if level == 'up':
             target = min(curr_level + 10, 100)
@@ -270,16 +500,16 @@ class Connection():
         return target
 
     def wake_up(self):
-        motion = self.session.service('ALMotion')
+        motion = self.service('ALMotion')
         motion.wakeUp()
 
     def rest(self):
-        motion = self.session.service('ALMotion')
+        motion = self.service('ALMotion')
         motion.rest()
 
     def init_dialog_window(self):
-        memory = self.session.service('ALMemory')
-        dialog = self.session.service('ALDialog')
+        memory = self.service('ALMemory')
+        dialog = self.service('ALDialog')
         wr = memory.subscriber('WordRecognizedAndGrammar')
         wr_id = wr.signal.connect(io.show_dialog_input)
         li = memory.subscriber('Dialog/Answered')
@@ -294,14 +524,96 @@ class Connection():
                 print('')
                 break
 
+    def get_info(self):
+        """Fetch the robot state shown by 'qidev info' in one round of calls.
+        :return: dict of field name to value
+        """
+        fields = [('name', 'ALSystem', 'robotName'),
+                  ('version', 'ALSystem', 'systemVersion'),
+                  ('language', 'ALTextToSpeech', 'getLanguage'),
+                  ('languages', 'ALTextToSpeech', 'getAvailableLanguages'),
+                  ('volume', 'ALAudioDevice', 'getOutputVolume'),
+                  ('posture', 'ALRobotPosture', 'getPosture'),
+                  ('posture_family', 'ALRobotPosture', 'getPostureFamily'),
+                  ('focused_activity', 'ALAutonomousLife', 'focusedActivity'),
+                  ('life_state', 'ALAutonomousLife', 'getState')]
+        values = self.gather([(service, method, ()) for _, service, method in fields])
+        return dict(zip([f[0] for f in fields], values))
+
     def get_robot_name(self):
-        system = self.session.service('ALSystem')
+        system = self.service('ALSystem')
         return system.robotName()
 
 
-def zip_dir(path, zipfile):
-    """Create a zip of contents of path by traversing it."""
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            zipfile.write(os.path.join(root, f),
-                          arcname=os.path.relpath(os.path.join(root, f), path))
+def ssh_hosts_path():
+    return os.path.join(cache.cache_path(), 'ssh_hosts.json')
+
+
+def _load_ssh_hosts():
+    global _ssh_hosts
+    if _ssh_hosts is None:
+        try:
+            with open(ssh_hosts_path(), 'r') as f:
+                _ssh_hosts = json.load(f)
+        except (IOError, ValueError):
+            _ssh_hosts = dict()
+    return _ssh_hosts
+
+
+def _save_ssh_hosts():
+    path = ssh_hosts_path()
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(_ssh_hosts, f)
+    os.rename(tmp, path)
+
+
+def forget_host(hostname):
+    """Drop what is known of hostname (see is_virtual), e.g. after it moved."""
+    _virtual_hosts.pop(hostname, None)
+    with _ssh_hosts_lock:
+        if _load_ssh_hosts().pop(hostname, None) is not None:
+            _save_ssh_hosts()
+
+
+def is_virtual(hostname):
+    """Is hostname a virtual robot? Real robots run an SSH server, virtual ones
+    (naoqi on the development machine) are assumed not to. The answer comes from
+    a short TCP probe of port 22 and is cached per hostname. Real robots are
+    also recorded in <cache_path>/ssh_hosts.json for address_ttl seconds, so that
+    later runs do not probe them again; a virtual robot refuses the probe at once.
+    """
+    if hostname not in _virtual_hosts:
+        with _ssh_hosts_lock:
+            answered = _load_ssh_hosts().get(hostname)
+        if answered and time.time() - answered <= groups.address_ttl():
+            _virtual_hosts[hostname] = False
+            return False
+        try:
+            socket.create_connection((hostname, 22), PROBE_TIMEOUT).close()
+            _virtual_hosts[hostname] = False
+            with _ssh_hosts_lock:
+                _load_ssh_hosts()[hostname] = time.time()
+                _save_ssh_hosts()
+        except socket.gaierror as e:
+            raise RuntimeError('{}: {} ... for hostname: {}'.format(col.red('ERROR'), e,
+                                                                    col.blue(hostname)))
+        except socket.error:
+            _virtual_hosts[hostname] = True
+    return _virtual_hosts[hostname]
+
+
+def sftp_makedirs(sftp, remote_dir, existing):
+    """Create remote_dir and its parents over SFTP if they do not exist.
+    :param existing: set of directories already known to exist, updated in place.
+    """
+    if not remote_dir or remote_dir == '/' or remote_dir in existing:
+        return
+    try:
+        sftp.stat(remote_dir)
+    except IOError:
+        sftp_makedirs(sftp, posixpath.dirname(remote_dir), existing)
+        sftp.mkdir(remote_dir)
+    existing.add(remote_dir)
@@ -0,0 +1,142 @@
+"""
+fleet.py
+
+functions for running one operation on many robots at once: a bounded number
+of robots are handled concurrently, connecting and operating are each bounded
+by a timeout, failed connections are retried, and the results come back in the
+order the robots were given.
+"""
+
+import time
+import threading
+import config
+
+DEFAULT_JOBS = 16  # robots handled at once
+DEFAULT_CONNECT_TIMEOUT = 15  # seconds
+DEFAULT_RETRIES = 1  # extra connection attempts
+RETRY_DELAY = 1.0  # seconds between connection attempts
+# upper bound for waiting on the whole fleet, in seconds
+MAX_WAIT = 24 * 60 * 60
+
+
+class Timeout(RuntimeError):
+    pass
+
+
+class Result(object):
+    """The outcome of an operation on one robot."""
+    __slots__ = ('host', 'value', 'error', 'attempts', 'timings')
+
+    def __init__(self, host):
+        self.host = host
+        self.value = None
+        self.error = None
+        self.attempts = 0
+        self.timings = dict()  # 'connect' and 'operation' seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _setting(field, default, cast):
+    try:
+        return cast(config.read_field(field))
+    except (TypeError, ValueError):
+        return default
+
+
+def default_jobs():
+    """Number of robots handled at once (config field fleet_jobs)."""
+    return max(_setting('fleet_jobs', DEFAULT_JOBS, int), 1)
+
+
+def default_connect_timeout():
+    """Seconds to wait for a connection (config field fleet_connect_timeout)."""
+    return _setting('fleet_connect_timeout', DEFAULT_CONNECT_TIMEOUT, float)
+
+
+def default_retries():
+    """Extra connection attempts (config field fleet_retries)."""
+    return max(_setting('fleet_retries', DEFAULT_RETRIES, int), 0)
+
+
+def call(func, args, timeout, what):
+    """Call func(*args) and return its result, waiting at most timeout seconds.
+    A call that times out keeps running in a daemon thread but is given up on.
+    :raise Timeout: if func did not return in time
+    """
+    outcome = dict()
+
+    def target():
+        try:
+            outcome['value'] = func(*args)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise Timeout('{} timed out after {:g}s'.format(what, timeout))
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+
+def run(hosts, connect, operation, jobs=None, connect_timeout=None, timeout=None,
+        retries=None):
+    """Connect to every host and run operation on the connection.
+    :param hosts: list of hostnames/IP addresses
+    :param connect: function of a host returning a connection
+    :param operation: function of a connection; its return value is kept
+    :param jobs: robots handled at once, default_jobs() by default
+    :param connect_timeout: seconds per connection attempt,
+    default_connect_timeout() by default
+    :param timeout: seconds for the operation, unbounded by default
+    :param retries: extra connection attempts, default_retries() by default; operations
+    are not retried since they may not be safe to repeat
+    :return: list of Result, in the order of hosts
+    """
+    from multiprocessing.pool import ThreadPool
+    jobs = jobs or default_jobs()
+    if connect_timeout is None:
+        connect_timeout = default_connect_timeout()
+    if retries is None:
+        retries = default_retries()
+
+    def handle(host):
+        result = Result(host)
+        conn = None
+        while conn is None:
+            result.attempts += 1
+            start = time.time()
+            try:
+                conn = call(connect, (host,), connect_timeout, 'connecting')
+            except Exception as e:
+                if result.attempts > retries:
+                    result.error = e
+                    result.timings['connect'] = time.time() - start
+                    return result
+                time.sleep(RETRY_DELAY)
+        result.timings['connect'] = time.time() - start
+        start = time.time()
+        try:
+            if timeout:
+                result.value = call(operation, (conn,), timeout, 'operation')
+            else:
+                result.value = operation(conn)
+        except Exception as e:
+            result.error = e
+        result.timings['operation'] = time.time() - start
+        return result
+
+    if not hosts:
+        return list()
+    pool = ThreadPool(min(jobs, len(hosts)))
+    try:
+        # map_async().get() with a timeout keeps the pool interruptible
+        return pool.map_async(handle, hosts).get(MAX_WAIT)
+    finally:
+        pool.close()
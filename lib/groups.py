@@ -0,0 +1,188 @@
+"""
+groups.py
+
+named groups of robots and robot tags kept in the .qidev config, e.g.
+
+"groups": {"showroom": ["Michelangelo.local", "Donatello.local"]},
+"tags": {"Michelangelo.local": ["pepper-v2.9"]}
+
+--group NAME selects the members of group NAME and the robots tagged NAME.
+
+The addresses robot hostnames resolve to (mDNS lookups of .local names can
+take seconds) are cached in <cache_path>/addresses.json for address_ttl
+seconds, and the addresses of a whole group are looked up at once. A
+connection that fails on a cached address looks it up again, see readdress.
+"""
+
+import os
+import json
+import time
+import socket
+import tempfile
+import threading
+import config
+import cache
+from clint.textui import colored as col
+
+# short, robots on DHCP change address; a failed connection also drops it
+DEFAULT_ADDRESS_TTL = 60
+# upper bound for the number of hostnames looked up at once
+MAX_LOOKUPS = 64
+
+_resolved = dict()  # (config dict, names) -> hostnames, see resolve
+_addresses = None  # hostname -> [address, time], loaded on first use
+_lock = threading.Lock()
+
+
+def groups():
+    """Return the groups, a dict of group name to hostnames."""
+    return config.read_field('groups') or dict()
+
+
+def tags():
+    """Return the tags, a dict of hostname to tag names."""
+    return config.read_field('tags') or dict()
+
+
+def split(hosts):
+    """Return a list of hostnames as str, which may be given as one string
+    (config field robots)."""
+    if isinstance(hosts, basestring):
+        hosts = hosts.replace(',', ' ').split()
+    return [str(h) for h in hosts]
+
+
+def unique(hosts):
+    seen = set()
+    return [h for h in hosts if not (h in seen or seen.add(h))]
+
+
+def members(name):
+    """Return the robots of group name and the robots tagged name, in order."""
+    hosts = split(groups().get(name, ()))
+    hosts.extend(sorted(split(h for h, names in tags().iteritems() if name in names)))
+    return unique(hosts)
+
+
+def fleet():
+    """Return every known robot: the robots config field, then the members of
+    every group, then the tagged robots."""
+    hosts = split(config.read_field('robots') or ())
+    for name in sorted(groups()):
+        hosts.extend(split(groups()[name]))
+    hosts.extend(sorted(split(tags())))
+    return unique(hosts)
+
+
+def resolve(names):
+    """Return the robots of the given groups/tags, in order and without
+    duplicates. Resolutions are cached until the config changes.
+    :raise RuntimeError: if a name is neither a group nor a tag
+    """
+    key = (id(config.load()), tuple(names))
+    if key not in _resolved:
+        hosts = list()
+        for name in names:
+            found = members(name)
+            if not found:
+                raise RuntimeError('{}: {} is neither a group nor a tag (see "qidev group")'
+                                   .format(col.red('error'), col.blue(name)))
+            hosts.extend(found)
+        _resolved.clear()  # older entries belong to an older config
+        _resolved[key] = unique(hosts)
+    return _resolved[key]
+
+
+def address_ttl():
+    """Return how long resolved addresses are kept (config field address_ttl)."""
+    try:
+        return float(config.read_field('address_ttl'))
+    except (TypeError, ValueError):
+        return DEFAULT_ADDRESS_TTL
+
+
+def addresses_path():
+    return os.path.join(cache.cache_path(), 'addresses.json')
+
+
+def _load_addresses():
+    global _addresses
+    if _addresses is None:
+        try:
+            with open(addresses_path(), 'r') as f:
+                _addresses = json.load(f)
+        except (IOError, ValueError):
+            _addresses = dict()
+    return _addresses
+
+
+def _save_addresses():
+    path = addresses_path()
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(_addresses, f)
+    os.rename(tmp, path)
+
+
+def _lookup(hostname):
+    try:
+        return socket.getaddrinfo(hostname, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
+    except (socket.gaierror, IndexError):
+        return None
+
+
+def _cached(hostname):
+    entry = _load_addresses().get(hostname)
+    if entry and time.time() - entry[1] <= address_ttl():
+        return entry[0]
+    return None
+
+
+def prefetch(hostnames):
+    """Look up the addresses of hostnames that are not cached, all at once."""
+    with _lock:
+        missing = [h for h in unique(hostnames) if not _cached(h)]
+    if not missing:
+        return
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(len(missing), MAX_LOOKUPS))
+    try:
+        found = pool.map_async(_lookup, missing).get(60 * len(missing))
+    finally:
+        pool.close()
+    now = time.time()
+    with _lock:
+        for hostname, addr in zip(missing, found):
+            if addr and addr != hostname:
+                _addresses[hostname] = [addr, now]
+        _save_addresses()
+
+
+def address(hostname):
+    """Return the cached address of hostname, looking it up if needed. The
+    hostname itself is returned if it is an address or cannot be resolved,
+    so that connecting reports the error."""
+    with _lock:
+        addr = _cached(hostname)
+    if addr:
+        return addr
+    addr = _lookup(hostname)
+    if not addr or addr == hostname:
+        return hostname
+    with _lock:
+        _addresses[hostname] = [addr, time.time()]
+        _save_addresses()
+    return addr
+
+
+def readdress(hostname):
+    """Drop the cached address of hostname, e.g. after connecting to it failed
+    (the robot may have a new DHCP lease), and look it up again.
+    :return: the new address, see address
+    """
+    with _lock:
+        if _load_addresses().pop(hostname, None):
+            _save_addresses()
+    return address(hostname)
@@ -3,18 +3,26 @@ handlers.py
 
 A handler is a function assigned to handle all the functionality associated
 with a particular command line subparser.
+
+Apart from config, modules are imported by the handlers that use them, so each
+command only loads its own dependencies (benchmarks/bench_startup.py checks it).
 """
 
 
 import os
-import clio as io
 import config
-from connection import Connection
-from clint.textui import colored as col
 import sys
-import select
-import re
-from threading import Thread
+import time
+
+# SQLite archive of the collected logs, in log_path
+ARCHIVE_FILE = 'naoqi-logs.db'
+
+
+def connect(verb, **kwargs):
+    """Create a Connection. The connection module pulls in qi (and paramiko for
+    SSH), so it is only imported by commands that talk to a robot."""
+    from connection import Connection
+    return Connection(verb, **kwargs)
 
 
 def verbose_print(flag):
@@ -25,101 +33,335 @@ def verbose_print(flag):
     return func
 
 
+def group_hosts(hosts, names):
+    """Add the robots of the groups/tags names to the robots of --ip and look up
+    their addresses at once.
+    :return: list of hostnames/IP addresses, without duplicates
+    """
+    import groups
+    hosts = groups.unique((hosts or list()) + groups.resolve(names))
+    groups.prefetch(hosts)
+    return hosts
+
+
+def run_fleet(ns, connect_host, operation, hosts=None):
+    """Run operation on every robot of --ip with the fleet options of ns.
+    :param connect_host: function of a hostname returning a connection
+    :param hosts: the robots, --ip by default
+    :return: list of fleet.Result, in the order of the robots
+    """
+    import fleet
+    return fleet.run(ns.ip if hosts is None else hosts, connect_host, operation,
+                     jobs=ns.jobs, connect_timeout=ns.connect_timeout, timeout=ns.timeout,
+                     retries=ns.retries)
+
+
+def exit_on_failure(results):
+    """Exit with status 1 if the operation failed on any robot."""
+    if not all(r.ok for r in results):
+        sys.exit(1)
+
+
+def fan_out(ns, connect_host, operation):
+    """Run operation on every robot of --ip, print an ordered summary and exit
+    with status 1 if it failed on any robot."""
+    import clio as io
+    results = run_fleet(ns, connect_host, operation)
+    io.show_fleet_summary(results)
+    exit_on_failure(results)
+
+
+def fan_out_selection(ns, connect_host, get_completions, operation, prompt=None):
+    """Run operation(connection, selection) on the robot, or on every robot of
+    --ip like fan_out; an operation returning False failed. Without --name the
+    user picks the selection among the completions gathered from every robot,
+    or the selection is None if get_completions is None.
+    :param prompt: function of the completions returning the selection, a
+    behavior (or with --service a service) prompt by default
+    """
+    import clio as io
+
+    if prompt is None:
+        def prompt(completions):
+            if ns.service:
+                return io.prompt_for_service(completions)
+            return io.prompt_for_behavior(completions)
+
+    selection = getattr(ns, 'name', None) or None
+    if not ns.ip:
+        conn = connect_host(None)
+        if not selection and get_completions:
+            selection = prompt(get_completions(conn))
+        operation(conn, selection)
+        return
+    # connect to every robot (and gather completions) before prompting, then
+    # run the operation on the robots that answered
+    first = run_fleet(ns, connect_host,
+                      lambda conn: (conn, get_completions(conn) if get_completions else ()))
+    conns = dict((r.host, r.value[0]) for r in first if r.ok)
+    if not selection and get_completions:
+        completions = set()
+        for r in first:
+            if r.ok:
+                completions.update(r.value[1])
+        selection = prompt(completions)
+    def operate(conn):
+        if operation(conn, selection) is False:
+            raise RuntimeError('failed')
+
+    second = iter(run_fleet(ns, conns.get, operate, hosts=[r.host for r in first if r.ok]))
+    results = list()
+    for r in first:
+        if r.ok:
+            result = next(second)
+            result.attempts = r.attempts
+            result.timings['connect'] = r.timings['connect']
+            r = result
+        results.append(r)
+    io.show_fleet_summary(results)
+    exit_on_failure(results)
+
+
 def install_handler(ns):
     """Install a package to a remote host or locally."""
+    import clio as io
+    import cache
+    import packager
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
-
-    def install(conn):
-        path = os.path.abspath(ns.path)
-        try:
-            verb('Create package from directory: {}'.format(path))
-            abs_path = conn.create_package(ns.path)
-            verb('Transfer package to {}'.format(conn.hostname))
-            pkg_name = conn.transfer(abs_path)
-            verb('Install package: {}'.format(pkg_name))
-            conn.install_package(abs_path)
-            verb('Clean up: {}'.format(pkg_name))
-            conn.delete_pkg_file(abs_path)
-            local_pkg = os.path.join(ns.path, '..', pkg_name)
-            verb('Remove locally: {}'.format(local_pkg))
-            os.remove(local_pkg)
-            print('installed {} on {}'.
-                  format(col.blue(pkg_name).replace('.pkg', ''),
-                         col.magenta(conn.get_robot_name())))
-        except IOError:
-            if os.path.exists(path):
-                print('{}: {} is not a project directory (does not contain manifest.xml)'
-                      .format(col.red('error'), col.blue(path)))
-            else:
-                print('{}: {} does not exist'.format(col.red('error'), col.blue(path)))
-
-    if ns.ip:
-        for conn in [Connection(verb, hostname=ip) for ip in ns.ip]:
-            install(conn)
+    path = os.path.abspath(ns.path)
+
+    def package():
+        """Build the package, or pick the cached build selected with --build."""
+        uuid = packager.get_package_uid(path)
+        if ns.build:
+            abs_path = cache.find_build(uuid, ns.build)
+            if not abs_path:
+                raise RuntimeError('{}: no single cached build of {} matches {}'.format(
+                    col.red('error'), col.blue(uuid), ns.build))
+            return abs_path
+        verb('Create package from directory: {}'.format(path))
+        return cache.get_package(path, uuid, verb, ns.verbose)
+
+    def install(conn, abs_path):
+        verb('Transfer package to {}'.format(conn.hostname))
+        pkg_name = conn.transfer(abs_path, io.progress_bar('upload'))
+        verb('Install package: {}'.format(pkg_name))
+        conn.install_package(abs_path)
+        verb('Clean up: {}'.format(pkg_name))
+        conn.delete_pkg_file(abs_path)
+        print('installed {} on {}'.
+              format(col.blue(pkg_name).replace('.pkg', ''),
+                     col.magenta(conn.get_robot_name())))
+
+    def sync(conn):
+        verb('Compare {} with installed app on {}'.format(path, conn.hostname))
+        result = conn.sync_package(path)
+        if result is None:
+            verb('Package not installed or manifest.xml changed: full install')
+            install(conn, package())
+        else:
+            changed, deleted = result
+            print('synced {} on {} ({} changed, {} deleted)'.
+                  format(col.blue(conn.get_package_uid(path)),
+                         col.magenta(conn.get_robot_name()),
+                         len(changed), len(deleted)))
+
+    def pipeline(conn, abs_path):
+        """Upload and install on one robot, timing each stage."""
+        timings = dict()
+        start = time.time()
+        conn.transfer(abs_path)
+        timings['upload'] = time.time() - start
+        timings['rate'] = conn.last_upload
+        start = time.time()
+        conn.install_package(abs_path)
+        conn.delete_pkg_file(abs_path)
+        timings['install'] = time.time() - start
+        print('installed {} on {}'.format(col.blue(os.path.basename(abs_path)[:-4]),
+                                          col.magenta(conn.hostname)))
+        return timings
+
+    def fleet_install():
+        """Build once, then upload to and install on every robot concurrently."""
+        abs_path = package()
+        results = run_fleet(ns, lambda ip: connect(verb, hostname=ip),
+                            lambda conn: pipeline(conn, abs_path))
+        io.show_install_summary(results)
+        exit_on_failure(results)
+
+    try:
+        if ns.ip and not ns.sync:
+            fleet_install()
+        elif ns.ip:
+            fan_out(ns, lambda ip: connect(verb, hostname=ip), sync)
+        elif ns.sync:
+            sync(connect(verb))
+        else:
+            install(connect(verb), package())
+    except IOError:
+        if os.path.exists(path):
+            print('{}: {} is not a project directory (does not contain manifest.xml)'
+                  .format(col.red('error'), col.blue(path)))
+        else:
+            print('{}: {} does not exist'.format(col.red('error'), col.blue(path)))
+
+
+def cache_handler(ns):
+    """List the cached package builds."""
+    import clio as io
+    import cache
+    uuids = [ns.uuid] if ns.uuid else cache.list_uuids()
+    table = list()
+    for uuid in uuids:
+        for key, pkg, used in cache.list_builds(uuid):
+            table.append([uuid, key[:12], os.path.getsize(pkg), used])
+    io.show_cached_builds(table)
+
+
+def agent_handler(ns):
+    """Start, stop or query the background connection agent."""
+    import agent
+    from clint.textui import colored as col
+    if ns.action == 'start':
+        if agent.running():
+            print('agent already running on {}'.format(col.blue(agent.socket_path())))
+        elif agent.start():
+            print('started agent on {}'.format(col.blue(agent.socket_path())))
+        else:
+            print('{}: agent did not start'.format(col.red('error')))
+    elif not agent.running():
+        print('agent is not running')
+    elif ns.action == 'stop':
+        agent.stop()
+        print('stopped agent')
+    elif ns.action == 'status':
+        print('agent running on {}'.format(col.blue(agent.socket_path())))
+        for hostname, idle in agent.status():
+            print('  {} (idle {:.0f}s)'.format(col.magenta(hostname), idle))
     else:
-        install(Connection(verb))
+        print(col.red('error') + ': agent action can only be "start", "stop" or "status"')
 
 
 def info_handler(ns):
+    """Show the state of the robot, or a table of the state of several robots."""
+    import clio as io
+    import groups
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb, ssh=False)
-    io.show_info(conn)
+
+    hosts = ns.ip
+    if ns.fleet:
+        hosts = groups.fleet()
+        if not hosts:
+            print('{}: set the robots to query first with "qidev config robots \"A B C\"" '
+                  'or "qidev group NAME A B C"'.format(col.red('error')))
+            return
+        groups.prefetch(hosts)
+    if not hosts:
+        io.show_info(connect(verb, ssh=False))
+        return
+    results = run_fleet(ns, lambda ip: connect(verb, hostname=ip, ssh=False),
+                        lambda conn: conn.get_info(), hosts=hosts)
+    rows = list()
+    for r in results:
+        if r.ok:
+            r.value['latency'] = r.timings['operation']
+        rows.append((r.host, r.value, r.error))
+    io.show_fleet_info(rows)
+    exit_on_failure(results)
 
 
 def remove_handler(ns):
     """Remove a package from the robot."""
+    import clio as io
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
-    def get_completions(conn, verb):
-        pkg_data = conn.get_installed_package_data(verb)
-        completions = [p.uuid for p in pkg_data] + [p.name for p in pkg_data]
-        return completions
+    installed = dict()  # connection -> PackageSet, fetched with the completions
+
+    def get_completions(conn):
+        installed[conn] = conn.get_installed_package_data(verb)
+        return installed[conn].package_keys()
 
     def remove(conn, inp):
-        # if we matched a package name, replace it with the pkg uuid
-        pkg_data = conn.get_installed_package_data(verb)
-        if inp in [p.name for p in pkg_data]:
-            for pkg in pkg_data:
-                if pkg.name == inp:
-                    verb('replace {} with {}'.format(inp, pkg.uuid))
-                    inp = pkg.uuid
-                    break
-        # if package removal fails or specified package is not installed on the robot
-        if not conn.remove_package(inp) or inp not in completions:
+        # with --name the completions were not gathered
+        if conn not in installed:
+            installed[conn] = conn.get_installed_package_data(verb)
+        pkg = installed[conn].get(inp)
+        # if specified package is not installed on the robot or package removal fails
+        if not pkg or not conn.remove_package(pkg.uuid):
             print('{}: package {} not installed on {}'.format(col.red('error'),
                                                               col.blue(inp),
                                                               col.magenta(conn.get_robot_name())))
-        else:  # package successfully removed
-            print('removed {} from {}'.format(col.blue(inp),
-                                              col.magenta(conn.get_robot_name())))
+            return False
+        if pkg.uuid != inp:
+            verb('replace {} with {}'.format(inp, pkg.uuid))
+        print('removed {} from {}'.format(col.blue(pkg.uuid),
+                                          col.magenta(conn.get_robot_name())))
 
-    if ns.ip:
-        conns = [Connection(verb, ssh=False, hostname=ip) for ip in ns.ip]
-        completions = set()
-        for conn in conns:
-            completions.update(get_completions(conn, verb))
-        inp = io.prompt_for_package(list(completions))
-        for conn in conns:
-            remove(conn, inp)
-    else:
-        conn = Connection(verb, ssh=False)
-        completions = get_completions(conn, verb)
-        inp = io.prompt_for_package(completions)
-        remove(conn, inp)
+    fan_out_selection(ns, lambda ip: agent.connection(verb, ssh=False, qi_session=False,
+                                                      hostname=ip),
+                      get_completions, remove,
+                      prompt=lambda completions: io.prompt_for_package(list(completions)))
 
 
 def config_handler(ns):
-    """Configure fields of the ~/.qidev file."""
+    """Configure fields of the ~/.qidev file. Only config is imported, so that
+    this stays the cheapest command to start."""
     config.write_field(ns.field.strip(), ns.value.strip())
-    print('set {} to {}'.format(col.blue(ns.field.strip()),
-                                col.blue(ns.value.strip())))
+    print('set {} to {}'.format(ns.field.strip(), ns.value.strip()))
+
+
+def group_handler(ns):
+    """List, define or delete the named groups of robots."""
+    import clio as io
+    import groups
+    from clint.textui import colored as col
+    if not ns.name:
+        io.show_groups(groups.groups(), groups.tags())
+    elif ns.delete:
+        if ns.name not in groups.groups():
+            print('{}: there is no group {}'.format(col.red('error'), col.blue(ns.name)))
+            return
+        config.write_field(['groups', ns.name], None)
+        print('deleted group {}'.format(col.blue(ns.name)))
+    elif ns.robots:
+        config.write_field(['groups', ns.name], groups.unique(ns.robots))
+        print('set group {} to {}'.format(col.blue(ns.name),
+                                          ' '.join(col.magenta(r) for r in ns.robots)))
+    else:
+        hosts = groups.members(ns.name)
+        if not hosts:
+            print('{}: {} is neither a group nor a tag'.format(col.red('error'),
+                                                              col.blue(ns.name)))
+            return
+        for host in hosts:
+            print(col.magenta(host))
+
+
+def tag_handler(ns):
+    """Show or set the tags of a robot."""
+    import groups
+    from clint.textui import colored as col
+    if ns.delete:
+        config.write_field(['tags', ns.robot], None)
+        print('removed the tags of {}'.format(col.magenta(ns.robot)))
+    elif ns.tags:
+        config.write_field(['tags', ns.robot], groups.unique(ns.tags))
+        print('tagged {} {}'.format(col.magenta(ns.robot),
+                                    ' '.join(col.blue(t) for t in ns.tags)))
+    else:
+        print(' '.join(col.blue(t) for t in groups.tags().get(ns.robot, ())))
 
 
 def connect_handler(ns):
     """Change hostname field of the .qidev file."""
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
     verb('Set hostname to {}'.format(ns.hostname))
-    Connection(verb, hostname=ns.hostname, ssh=False)
+    connect(verb, hostname=ns.hostname, ssh=False)
     config.write_field('hostname', ns.hostname)
     print('set {} to {}'.format(col.blue('hostname'),
                                 col.magenta(ns.hostname)))
@@ -127,16 +369,17 @@ def connect_handler(ns):
 
 def show_handler(ns):
     """Display information about a package, service, active content, etc."""
+    import clio as io
+    import agent
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb, ssh=False)
+    conn = agent.connection(verb, ssh=False, qi_session=False)
     verb('Check installed packages...')
-    pkg_data = conn.get_installed_package_data(verb)
+    pkg_data = conn.get_installed_package_data(verb, refresh=ns.refresh)
     if ns.services:
         verb('Show installed services')
         io.show_installed_services(verb, pkg_data)
     elif ns.inspect:
-        completions = [p.uuid for p in pkg_data] + [p.name for p in pkg_data]
-        inp = io.prompt_for_package(completions)
+        inp = io.prompt_for_package(pkg_data.package_keys())
         io.show_package_details(inp, pkg_data)
     elif ns.active:
         verb('Show active content')
@@ -149,6 +392,8 @@ def show_handler(ns):
 
 def start_handler(ns):
     """Focus an activity, start a behavior or service."""
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
     def start(conn, selection):
@@ -162,11 +407,13 @@ def start_handler(ns):
             else:
                 print('{}: failed to start service {} on {} (is it already running?)'.
                       format(error, s, name))
+                return False
         elif ns.behavior:
             if conn.start_behavior(selection):
                 print('started {} behavior on {}'.format(s, name))
             else:
                 print('{}: {} is not installed on {}'.format(error, s, name))
+                return False
         else:
             if conn.life_switch_focus(selection):
                 print('focused {} activity on {}'.format(s, name))
@@ -175,33 +422,24 @@ def start_handler(ns):
             else:
                 print('{}: {} failed to switch focus to {} activity'.
                       format(error, name, s))
+                return False
 
     def get_completions(conn):
+        pkg_data = conn.get_installed_package_data(verb)
         if ns.service:
-            return conn.get_declared_services()
+            return pkg_data.service_names()
         else:
-            return conn.get_installed_behaviors()
+            return pkg_data.launch_paths()
 
-    if ns.ip:
-        conns = [Connection(verb, ssh=False, hostname=ip) for ip in ns.ip]
-    else:
-        conns = [Connection(verb, ssh=False)]
-    selection = ns.name if ns.name else None
-    if not selection:
-        completions = set()
-        for conn in conns:
-            completions.update(get_completions(conn))
-        if ns.service:
-            selection = io.prompt_for_service(completions)
-        else:
-            selection = io.prompt_for_behavior(completions)
-    for conn in conns:
-        t = Thread(target=start, args=(conn, selection))
-        t.start()
+    fan_out_selection(ns, lambda ip: agent.connection(verb, ssh=False, qi_session=False,
+                                                      hostname=ip),
+                      get_completions, start)
 
 
 def stop_handler(ns):
     """Stop an activity, behavior or service."""
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
     def stop(conn, selection):
@@ -215,15 +453,18 @@ def stop_handler(ns):
             else:
                 print('{}: failed to stop service {} on {}'.
                       format(error, s, name))
+                return False
         elif ns.behavior:
             if conn.stop_behavior(selection):
                 print('stopped {} behavior on {}'.format(s, name))
             else:
                 print('{}: {} is not installed on {}'.format(error, s, name))
+                return False
         else:
             focused = conn.get_focused_activity()
             if not focused:
                 print('{}: there is no focused activity on {}'.format(error, name))
+                return False
             else:
                 focused = col.blue(focused)
                 if conn.life_stop_focus():
@@ -233,6 +474,7 @@ def stop_handler(ns):
                 else:
                     print('{}: failed to stop focused activity on {}'.
                           format(error, name))
+                    return False
 
     def get_completions(conn):
         if ns.service:
@@ -240,29 +482,16 @@ def stop_handler(ns):
         else:
             return conn.get_running_behaviors()
 
-    if ns.ip:
-        conns = [Connection(verb, ssh=False, hostname=ip) for ip in ns.ip]
-    else:
-        conns = [Connection(verb, ssh=False)]
-    selection = ns.name if ns.name else None
-    if ns.behavior or ns.service:
-        if not selection:
-            completions = set()
-            for conn in conns:
-                completions.update(get_completions(conn))
-            if ns.service:
-                selection = io.prompt_for_service(completions)
-            else:
-                selection = io.prompt_for_behavior(completions)
-    for conn in conns:
-        t = Thread(target=stop, args=(conn, selection))
-        t.start()
+    fan_out_selection(ns, lambda ip: agent.connection(verb, ssh=False, hostname=ip),
+                      get_completions if ns.behavior or ns.service else None, stop)
 
 
 def life_handler(ns):
     """Toggle Autonomous Life ON or OFF."""
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb, ssh=False)
+    conn = agent.connection(verb, ssh=False)
     if ns.state == 'on':
         conn.life_on()
         print('started autonomous life service')
@@ -275,6 +504,8 @@ def life_handler(ns):
 
 def nao_handler(ns):
     """Issue a nao command via SSH."""
+    import clio as io
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
     def nao_command(conn):
@@ -283,59 +514,56 @@ def nao_handler(ns):
         command = 'sudo /etc/init.d/naoqi {}'.format(ns.action)
         verb(command)
         sshin, sshout, ssherr = conn.ssh.exec_command(command)
-        io.format_nao_output(sshout, ns.action)
-        print('\n')
+        if ns.ip:
+            # robots print at once, tell their lines apart
+            io.format_nao_output(sshout, ns.action, conn.hostname.ljust(width))
+        else:
+            io.format_nao_output(sshout, ns.action)
+            print('\n')
 
+    width = max(len(ip) for ip in ns.ip) if ns.ip else 0
     if ns.ip:
-        for ip in ns.ip:
-            try:
-                nao_command(Connection(verb, hostname=ip))
-            except RuntimeError as e:
-                print(e)
+        fan_out(ns, lambda ip: connect(verb, hostname=ip), nao_command)
     else:
-        nao_command(Connection(verb))
+        nao_command(connect(verb))
 
 
 def reboot_handler(ns):
     """Reboot the robot."""
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
     def reboot(conn):
         print('Reboot {}'.format(col.magenta(conn.get_robot_name())))
-        t = Thread(target=conn.robot_reboot)
-        t.start()
+        conn.robot_reboot()
 
     if ns.ip:
-        for ip in ns.ip:
-            try:
-                reboot(Connection(verb, hostname=ip, ssh=False))
-            except RuntimeError as e:
-                print(e)
+        fan_out(ns, lambda ip: agent.connection(verb, hostname=ip, ssh=False), reboot)
     else:
-        reboot(Connection(verb, ssh=False))
+        reboot(agent.connection(verb, ssh=False))
 
 
 def shutdown_handler(ns):
     """Shutdown the robot."""
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
     def shutdown(conn):
         print('{} shutting down'.format(col.magenta(conn.get_robot_name())))
-        t = Thread(target=conn.robot_shutdown)
-        t.start()
+        conn.robot_shutdown()
 
     if ns.ip:
-        for ip in ns.ip:
-            try:
-                shutdown(Connection(verb, hostname=ip, ssh=False))
-            except RuntimeError as e:
-                print(e)
+        fan_out(ns, lambda ip: agent.connection(verb, hostname=ip, ssh=False), shutdown)
     else:
-        shutdown(Connection(verb, ssh=False))
+        shutdown(agent.connection(verb, ssh=False))
 
 
 def vol_handler(ns):
     """Change the volume of the robot."""
+    import agent
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
 
     def set_vol(conn):
@@ -345,35 +573,34 @@ def vol_handler(ns):
               .format(conn.get_robot_name(), col.magenta(target)))
 
     if ns.ip:
-        for ip in ns.ip:
-            try:
-                set_vol(Connection(verb, hostname=ip, ssh=False))
-            except RuntimeError as e:
-                print(e)
+        fan_out(ns, lambda ip: agent.connection(verb, hostname=ip, ssh=False), set_vol)
     else:
-        set_vol(Connection(verb, ssh=False))
+        set_vol(agent.connection(verb, ssh=False))
 
 
 def wake_handler(ns):
     """Wake up the robot."""
+    import agent
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb, ssh=False)
+    conn = agent.connection(verb, ssh=False)
     print('Waking up {}'.format(conn.get_robot_name()))
     conn.wake_up()
 
 
 def rest_handler(ns):
     """Put the robot to rest."""
+    import agent
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb, ssh=False)
+    conn = agent.connection(verb, ssh=False)
     print('Put {} to rest'.format(conn.get_robot_name()))
     conn.rest()
 
 
 def dialog_handler(ns):
     """Show the dialog window."""
+    import clio as io
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb, ssh=False)
+    conn = connect(verb, ssh=False)
     verb('Show dialog window')
     io.show_dialog_header(conn)
     conn.init_dialog_window()
@@ -381,44 +608,101 @@ def dialog_handler(ns):
 
 def log_handler(ns):
     """Display the naoqi tail logs to the terminal with colors."""
+    import clio as io
+    import logs
+    from clint.textui import colored as col
     verb = verbose_print(ns.verbose)
-    conn = Connection(verb)
     p = '/var/log/naoqi/tail-naoqi.log'
-    if ns.cp:
+    lp = config.read_field('log_path')
+    log_dir = os.path.expanduser(lp if lp else '~')
+    try:
+        since = logs.since_epoch(ns.since) if ns.since else None
+        until = logs.since_epoch(ns.until) if ns.until else None
+    except ValueError as e:
+        print('{}: {}'.format(col.red('error'), e))
+        return
+    stages = logs.remote_filter(ns.level, ns.grep)
+
+    def ingest():
+        """Add the collected logs of every robot (or of --ip) to the archive."""
+        import archive
+        db = archive.connect(os.path.join(log_dir, ARCHIVE_FILE))
+        robots = ns.ip or sorted(os.listdir(log_dir))
+        for robot in robots:
+            path = os.path.join(log_dir, robot, 'tail-naoqi.log')
+            if os.path.isfile(path):
+                added = archive.ingest(db, robot, path)
+                print('archived {} lines of {}'.format(added, col.magenta(robot)))
+            elif ns.ip:
+                print('{}: no collected logs of {}, run "qidev log --cp" first'
+                      .format(col.red('error'), col.magenta(robot)))
+        db.close()
+
+    def query():
+        import archive
+        db = archive.connect(os.path.join(log_dir, ARCHIVE_FILE))
+        rows = archive.query(db, robots=ns.ip, level=ns.level, category=ns.category,
+                             since=since, until=until, grep=ns.grep, limit=ns.limit)
+        db.close()
+        io.show_archived_logs(rows)
+
+    if ns.action == 'ingest':
+        return ingest()
+    elif ns.action == 'query':
+        return query()
+
+    def collect(conn):
+        local_dir = os.path.join(log_dir, conn.hostname)
+        try:
+            collected = logs.collect(conn, p, local_dir, stages, since)
+            print('collected {} bytes of logs from {} into {}'.format(
+                collected, col.magenta(conn.hostname),
+                col.blue(os.path.join(local_dir, 'tail-naoqi.log' +
+                                      ('.filtered' if stages else '')))))
+        finally:
+            conn.ssh.close()
+
+    def open_tail(conn):
+        channel = conn.ssh.get_transport().open_session()
+        channel.exec_command(logs.tail_command(p, stages, since))
+        return channel
+
+    def write(text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    if ns.cp and ns.ip:
+        fan_out(ns, lambda ip: connect(verb, hostname=ip), collect)
+    elif ns.cp:
+        try:
+            collect(connect(verb))
+        except RuntimeError as e:
+            print('{}: {}'.format(col.red('error'), e))
+            sys.exit(1)
+    elif ns.ip and len(ns.ip) > 1:
+        results = run_fleet(ns, lambda ip: connect(verb, hostname=ip),
+                            lambda conn: (conn.get_robot_name(), conn))
+        for r in results:
+            if not r.ok:
+                print('{}: {} on {}'.format(col.red('error'), r.error, col.magenta(r.host)))
+        conns = [r.value[1] for r in results if r.ok]
+        if not conns:
+            sys.exit(1)
         try:
-            lp = config.read_field('log_path')
-            if not lp:
-                lp = '~'
-            log_path = os.path.expanduser(lp)
-            conn.remote_get(p, log_path)
-            print('secure copied logs to ' +
-                  col.blue(os.path.join(log_path, 'tail-naoqi.log')))
-        except RuntimeError:
-            print(col.red('error') + ': tail-naoqi.log not found on ' +
-                  col.magenta(conn.get_robot_name()))
+            logs.follow_merged([(r.value[0], open_tail(r.value[1])) for r in results if r.ok],
+                               write, ns.level, ns.category)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            verb('close the SSH Clients')
+            for conn in conns:
+                conn.ssh.close()
     else:
-        transport = conn.ssh.get_transport()
-        channel = transport.open_session()
-        remote_command = 'tail -f ' + p + ' & { read ; kill %1; }'
-        channel.exec_command(remote_command)
-
-        def print_log(log):
-            log = re.sub(r'(\[E\].*)\n', r'\033[0;31m\1\033[0m\n', log)  # error red
-            log = re.sub(r'(\[W\].*)\n', r'\033[0;33m\1\033[0m\n', log)  # warning yellow
-            sys.stdout.write(log)
-
-        while True:
-            try:
-                rl, wl, xl = select.select([channel], [], [], 0.0)
-                if len(rl) > 0:  # Must be stdout
-                    print_log(channel.recv(1024))
-            except:
-                try:
-                    print('close the SSH Client')
-                    conn.ssh.close()
-                except Exception as e:
-                    print('exception when closing SSH Client: {}'.format(e))
-                finally:
-                    break
-
-                
+        conn = connect(verb, hostname=ns.ip[0] if ns.ip else None)
+        try:
+            logs.follow(open_tail(conn), write, logs.make_filter(ns.level, ns.category))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            verb('close the SSH Client')
+            conn.ssh.close()
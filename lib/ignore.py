@@ -0,0 +1,110 @@
+"""
+ignore.py
+
+gitignore-style exclusion of project files from packages. Patterns come from
+DEFAULTS and from the .qidevignore file at the root of the project, e.g.
+
+# test fixtures
+tests/fixtures/
+*.log
+!important.log
+
+Later patterns override earlier ones, and a file in an excluded directory
+cannot be included again (as with git, since the directory is not walked).
+Directories holding a virtualenv are excluded too.
+"""
+
+import os
+import re
+
+IGNORE_FILE = '.qidevignore'
+DEFAULTS = ['.git/', '.svn/', '.hg/', IGNORE_FILE, '.gitignore',
+            '*.pyc', '*.pyo', '__pycache__/',
+            '.*.sw[a-p]', '*~', '.#*', '.DS_Store', 'Thumbs.db',
+            '.idea/', '.vscode/', '.tox/', 'venv/', '.venv/']
+VENV_MARKERS = ('pyvenv.cfg', os.path.join('bin', 'activate'))
+
+
+def translate(glob):
+    """Translate a gitignore glob into a regular expression over '/' separated
+    paths: * and ? do not match '/', ** matches across directories."""
+    i, n, res = 0, len(glob), ''
+    while i < n:
+        c = glob[i]
+        if glob.startswith('**/', i):
+            res += '(?:.*/)?'
+            i += 3
+            continue
+        if glob.startswith('**', i):
+            res += '.*'
+            i += 2
+            continue
+        if c == '*':
+            res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '[' and glob.find(']', i + 2) > 0:
+            j = glob.find(']', i + 2)
+            chars = glob[i + 1:j].replace('\\', '\\\\')
+            if chars[0] in '!^':
+                chars = '^' + chars[1:]
+            res += '[' + chars + ']'
+            i = j
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            res += re.escape(glob[i])
+        else:
+            res += re.escape(c)
+        i += 1
+    return res
+
+
+def parse(lines):
+    """Parse gitignore lines into a list of (regex, negated, directories only,
+    anchored) tuples. Anchored patterns (containing a '/' other than a trailing
+    one) match the path relative to the root, the others the file name."""
+    patterns = list()
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.endswith('\\ '):
+            line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        if negated or line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            continue
+        anchored = '/' in line
+        regex = re.compile('^' + translate(line.lstrip('/')) + '$')
+        patterns.append((regex, negated, dir_only, anchored))
+    return patterns
+
+
+class Rules(object):
+    """The exclusion rules of a project directory."""
+
+    def __init__(self, root):
+        self.root = root
+        self.patterns = parse(DEFAULTS)
+        try:
+            with open(os.path.join(root, IGNORE_FILE), 'r') as f:
+                self.patterns.extend(parse(f))
+        except IOError:
+            pass
+
+    def excludes(self, rel_path, is_dir=False):
+        """Is the file or directory at rel_path ('/' separated) excluded?"""
+        name = rel_path.rsplit('/', 1)[-1]
+        excluded = False
+        for regex, negated, dir_only, anchored in self.patterns:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path if anchored else name):
+                excluded = not negated
+        if not excluded and is_dir:
+            abs_path = os.path.join(self.root, *rel_path.split('/'))
+            excluded = any(os.path.exists(os.path.join(abs_path, m)) for m in VENV_MARKERS)
+        return excluded
@@ -0,0 +1,79 @@
+"""
+inventory.py
+
+an on-disk snapshot of the packages installed on each robot, so that show
+tables and completion prompts do not need a PackageManager round trip.
+
+Snapshots live in <cache_path>/inventory/<hostname>.json, expire after
+inventory_ttl seconds and are dropped when qidev installs or removes a package.
+The PackageManager API a robot answers to is remembered past expiry.
+"""
+
+import os
+import json
+import time
+import tempfile
+import config
+import cache
+
+DEFAULT_TTL = 300
+
+
+def ttl():
+    """Return the snapshot lifetime in seconds (config field inventory_ttl)."""
+    try:
+        return float(config.read_field('inventory_ttl'))
+    except (TypeError, ValueError):
+        return DEFAULT_TTL
+
+
+def snapshot_path(hostname):
+    return os.path.join(cache.cache_path(), 'inventory', hostname + '.json')
+
+
+def read(hostname):
+    """Return the snapshot of hostname as a dict, or None."""
+    try:
+        with open(snapshot_path(hostname), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def load(hostname):
+    """Return the package dicts of a fresh snapshot of hostname, or None."""
+    snapshot = read(hostname)
+    if not snapshot or snapshot.get('packages') is None:
+        return None
+    if time.time() - snapshot['time'] > ttl():
+        return None
+    return snapshot['packages']
+
+
+def api(hostname):
+    """Return the PackageManager API last used with hostname, or None."""
+    snapshot = read(hostname)
+    return snapshot.get('api') if snapshot else None
+
+
+def write(hostname, snapshot):
+    path = snapshot_path(hostname)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.rename(tmp, path)
+
+
+def save(hostname, pm_api, packages):
+    """Store the package dicts returned by the PackageManager API pm_api."""
+    write(hostname, {'time': time.time(), 'api': pm_api, 'packages': packages})
+
+
+def invalidate(hostname):
+    """Drop the packages of hostname's snapshot, keeping the API it uses."""
+    snapshot = read(hostname)
+    if snapshot and snapshot.get('packages') is not None:
+        snapshot['packages'] = None
+        write(hostname, snapshot)
@@ -0,0 +1,335 @@
+"""
+logs.py
+
+functions for parsing, filtering and rendering NAOqi log lines, e.g.
+
+[W] 1445950042.125310 6284 ALBehaviorManager: Behavior not found
+"""
+
+import os
+import re
+import json
+import zlib
+import time
+import pipes
+import datetime
+import posixpath
+import tempfile
+import heapq
+import collections
+import select
+import socket
+
+# [level] timestamp thread category: message
+LINE_RE = re.compile(r'\[([A-Z])\]\s+(\S+)\s+(\S+)\s+(\S+?):\s?(.*)$')
+# most severe first
+LEVELS = 'FEWIVD'
+COLORS = {'F': '\033[0;31m', 'E': '\033[0;31m', 'W': '\033[0;33m'}
+TAG_COLOR = '\033[0;35m'
+RESET = '\033[0m'
+BUFSIZE = 65536
+MAX_BATCH = 1048576  # render at most this many bytes at once
+# recv wakes up this often, so that Ctrl-C is not blocked by the wait (python 2)
+WAKE_UP = 1.0
+# seconds a line of a merged stream is held back to be ordered with the others
+REORDER_WINDOW = 0.5
+# per robot directory file recording how far each remote log was collected
+OFFSETS_FILE = '.offsets.json'
+
+
+def parse(line):
+    """Split a log line into (level, timestamp, thread, category, message), or
+    return None if it is not a log line (e.g. a continuation line)."""
+    m = LINE_RE.match(line)
+    return m.groups() if m else None
+
+
+def level_rank(level):
+    """Rank of a level letter, 0 being the most severe."""
+    rank = LEVELS.find(level)
+    return rank if rank >= 0 else len(LEVELS)
+
+
+def make_filter(level=None, category=None):
+    """Return a predicate on log lines, or None if nothing is filtered.
+    :param level: show this level and the more severe ones, e.g. 'W'
+    :param category: regular expression searched in the category
+    Lines that are not log lines follow the decision taken for the last log line.
+    """
+    if not level and not category:
+        return None
+    max_rank = level_rank(level.upper()[0]) if level else len(LEVELS)
+    category_re = re.compile(category) if category else None
+    state = {'keep': True}
+
+    def keep(line):
+        fields = parse(line)
+        if fields:
+            state['keep'] = (level_rank(fields[0]) <= max_rank and
+                             (not category_re or bool(category_re.search(fields[3]))))
+        return state['keep']
+    return keep
+
+
+def colorize(line):
+    """Color a log line according to its level."""
+    color = COLORS.get(line[1:2]) if line.startswith('[') else None
+    return color + line + RESET if color else line
+
+
+def render(lines, line_filter=None):
+    """Filter and color complete lines into one string ready to be written."""
+    if line_filter:
+        lines = [l for l in lines if line_filter(l)]
+    if not lines:
+        return ''
+    return '\n'.join(colorize(l) for l in lines) + '\n'
+
+
+def follow(channel, write, line_filter=None):
+    """Render a log stream from a paramiko channel until it closes.
+    Blocks on the channel rather than polling it; everything already received
+    is rendered in one write, and lines split across reads are reassembled.
+    :param write: function writing rendered text, e.g. sys.stdout.write
+    """
+    partial = ''
+    channel.settimeout(WAKE_UP)
+    while True:
+        try:
+            data = channel.recv(BUFSIZE)
+        except socket.timeout:
+            continue
+        if not data:
+            break
+        chunks = [data]
+        size = len(data)
+        while size < MAX_BATCH and channel.recv_ready():
+            data = channel.recv(BUFSIZE)
+            if not data:
+                break
+            chunks.append(data)
+            size += len(data)
+        lines = (partial + ''.join(chunks)).split('\n')
+        partial = lines.pop()
+        text = render(lines, line_filter)
+        if text:
+            write(text)
+    if partial:
+        write(render([partial], line_filter))
+
+
+def timestamp(line):
+    """Return the timestamp of a log line as a float, or None."""
+    fields = parse(line)
+    if fields:
+        try:
+            return float(fields[1])
+        except ValueError:
+            pass
+    return None
+
+
+def follow_merged(streams, write, level=None, category=None, window=REORDER_WINDOW):
+    """Render the log streams of several robots as one, ordered by log timestamp.
+    All channels are read from a single select loop. Each line is held back for
+    window seconds after it arrives, so that lines of other robots with earlier
+    timestamps (clock or network skew) can be written before it.
+    :param streams: list of (tag, paramiko channel); tags prefix the lines
+    :param level, category: see make_filter, applied to each stream
+    """
+    tag_width = max(len(tag) for tag, _ in streams)
+    state = dict()  # channel -> [tag, partial line, line filter, last timestamp]
+    for tag, channel in streams:
+        channel.setblocking(0)
+        state[channel] = [TAG_COLOR + tag.ljust(tag_width) + RESET, '',
+                          make_filter(level, category), 0.0]
+    pending = list()  # heap of (log timestamp, sequence, text)
+    arrivals = collections.deque()  # (arrival, sequence) of pending lines, oldest first
+    written = set()  # sequences written ahead of their turn in arrivals
+    sequence = 0
+    while state or pending:
+        readable = list()
+        if state:
+            readable, _, _ = select.select(list(state), [], [], window / 2)
+        now = time.time()
+        for channel in readable:
+            tag, partial, line_filter, last = state[channel]
+            chunks = list()
+            while True:
+                try:
+                    data = channel.recv(BUFSIZE)
+                except socket.timeout:  # nothing left to read
+                    break
+                chunks.append(data)
+                if not data or not channel.recv_ready():
+                    break
+            data = ''.join(chunks)
+            lines = (partial + data).split('\n')
+            partial = '' if not data else lines.pop()
+            for line in lines:
+                if not line or (line_filter and not line_filter(line)):
+                    continue
+                # continuation lines are ordered with the line they belong to
+                last = timestamp(line) or last
+                heapq.heappush(pending, (last, sequence, tag + ' ' + colorize(line)))
+                arrivals.append((now, sequence))
+                sequence += 1
+            if not data:
+                del state[channel]
+            else:
+                state[channel] = [tag, partial, line_filter, last]
+        # once the oldest line has waited window seconds, write every line that
+        # sorts before it, then the line itself
+        out = list()
+        while arrivals and (not state or arrivals[0][0] <= now - window):
+            _, oldest = arrivals.popleft()
+            if oldest in written:
+                written.remove(oldest)
+                continue
+            while True:
+                _, seq, text = heapq.heappop(pending)
+                out.append(text)
+                if seq == oldest:
+                    break
+                written.add(seq)
+        if out:
+            write('\n'.join(out) + '\n')
+
+
+def since_epoch(text):
+    """Parse a --since value into epoch seconds: epoch seconds, a duration ago
+    ('90s', '15m', '2h', '1d') or a local time 'YYYY-MM-DD[ HH:MM[:SS]]'."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    text = text.strip()
+    if text[-1:] in units:
+        try:
+            return time.time() - float(text[:-1]) * units[text[-1]]
+        except ValueError:
+            pass
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(datetime.datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            pass
+    raise ValueError('cannot parse time: {}'.format(text))
+
+
+def remote_filter(level=None, pattern=None):
+    """Return the shell pipeline stages that filter log lines on the robot, so
+    that only matching lines cross the network.
+    :param level: keep this level and the more severe ones, e.g. 'W'; lines
+    that are not log lines (tracebacks) are kept with the log line before them
+    :param pattern: extended regular expression the lines must match
+    """
+    stages = list()
+    if level:
+        levels = LEVELS[:level_rank(level.upper()[0]) + 1]
+        stages.append("awk '/^\\[/ {{ keep = /^\\[[{}]\\]/ }} keep {{ print; fflush() }}'"
+                      .format(levels))
+    if pattern:
+        stages.append('grep --line-buffered -E -e ' + pipes.quote(pattern))
+    return stages
+
+
+def time_filter(since):
+    """Return the stage keeping the lines logged at or after since (epoch
+    seconds), and the lines that are not log lines after them."""
+    return ("awk -v since={:f} '/^\\[/ {{ keep = $2 + 0 >= since }} keep {{ print; fflush() }}'"
+            .format(since))
+
+
+def tail_command(remote_path, stages=(), since=None):
+    """Return the command following remote_path through the filter stages and,
+    with since, the time_filter; it exits when the SSH channel is closed."""
+    command = 'tail -f '
+    if since is not None:
+        # filtering on time reads the whole file, not only its last lines
+        command = 'tail -n +1 -f '
+        stages = list(stages) + [time_filter(since)]
+    command += pipes.quote(remote_path)
+    for stage in stages:
+        command += ' | ' + stage
+    return command + ' & { read ; kill %1; }'
+
+
+def read_offsets(local_dir):
+    """Return the byte offsets already collected, by remote path."""
+    try:
+        with open(os.path.join(local_dir, OFFSETS_FILE), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+
+def write_offsets(local_dir, offsets):
+    fd, tmp = tempfile.mkstemp(dir=local_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(offsets, f)
+    os.rename(tmp, os.path.join(local_dir, OFFSETS_FILE))
+
+
+def collect(conn, remote_path, local_dir, stages=(), since=None):
+    """Append what was written to remote_path since the last collection to
+    local_dir/<file name>. The robot gzips the new bytes before sending them.
+    If the remote file shrank (rotated), it is collected from the start again.
+    :param conn: a Connection with SSH
+    :param stages: remote_filter stages; only the matching lines of the new
+    bytes are sent and they are appended to <file name>.filtered instead.
+    :param since: only send the new lines logged at or after these epoch
+    seconds (see time_filter). The bound does not change the file or the
+    offset: the next collection resumes after these bytes.
+    :return: the number of bytes collected
+    """
+    if not os.path.isdir(local_dir):
+        os.makedirs(local_dir)
+    name = posixpath.basename(remote_path)
+    key = remote_path
+    if stages:
+        name += '.filtered'
+        key += ' | ' + ' | '.join(stages)
+    local_path = os.path.join(local_dir, name)
+    if since is not None:
+        stages = list(stages) + [time_filter(since)]
+    offsets = read_offsets(local_dir)
+    offset = offsets.get(key, 0) if os.path.exists(local_path) else 0
+    command = ('f={}; size=$(stat -c %s "$f") || exit 1; start={}; '
+               '[ "$size" -lt "$start" ] && start=0; echo "$size $start"; '
+               'tail -c +$((start + 1)) "$f" | head -c $((size - start)){} | gzip -c'
+               ).format(pipes.quote(remote_path), offset,
+                        ''.join(' | ' + stage for stage in stages))
+    sshin, sshout, ssherr = conn.ssh.exec_command(command)
+    header = sshout.readline().split()
+    if len(header) != 2:
+        raise RuntimeError('{} not found'.format(remote_path))
+    size, start = int(header[0]), int(header[1])
+    gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    collected = 0
+    length = os.path.getsize(local_path) if os.path.exists(local_path) else 0
+    with open(local_path, 'ab') as f:
+        try:
+            while True:
+                data = sshout.read(BUFSIZE)
+                if not data:
+                    break
+                data = gunzip.decompress(data)
+                f.write(data)
+                collected += len(data)
+            data = gunzip.flush()
+            f.write(data)
+            collected += len(data)
+            if sshout.channel.recv_exit_status() != 0:
+                raise RuntimeError('{}: collection failed on the robot'.format(remote_path))
+            if not stages and collected != size - start:
+                raise RuntimeError('{}: received {} of {} bytes'.format(
+                    remote_path, collected, size - start))
+        except:
+            # drop the partial data, the offset still points before it
+            f.truncate(length)
+            raise
+    offsets[key] = size
+    write_offsets(local_dir, offsets)
+    return collected
@@ -9,7 +9,6 @@ packages2())
 """
 import re
 import os
-import qi
 
 # Example PACKAGE_2
 PACKAGE_2 = {
@@ -112,29 +111,44 @@ PACKAGE_1 = {
 }
 
 
+class lazy(object):
+    """Decorator for an attribute computed on first access and then stored in
+    the slot (or instance attribute) named '_' + the function's name."""
+
+    def __init__(self, func):
+        self.func = func
+        self.slot = '_' + func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        try:
+            return getattr(obj, self.slot)
+        except AttributeError:
+            value = self.func(obj)
+            setattr(obj, self.slot, value)
+            return value
+
+
 class Package(object):
+    __slots__ = ('pdict', 'lang', 'uuid', 'name', 'path', 'version',
+                 '_utterable_name', '_naoqi_reqs', '_supported_langs',
+                 '_description', '_behaviors', '_services')
 
     def __init__(self, pdict, lang):
         """Create an instance of a Package based on a dict of manifest data.
+        Only uuid, name, path and version are read up front, the other fields
+        are computed on first access.
         :param pdict: dict of the package's manifest data
         :param lang: the language to use e.g. en_US
         """
+        self.pdict = pdict
+        self.lang = lang
         self.uuid = pdict['uuid']
         self.name = self.get_name(pdict, lang)
-        self.utterable_name = make_utterable(self.name)
         self.path = pdict['path']
         self.version = pdict['version']
-        self.author = pdict['author']
-        self.channel = pdict['channel']
-        self.organization = pdict['organization']
-        self.date = pdict['date']
-        self.type_version = pdict['typeVersion']
-        self.installer = pdict['installer']
-        self.naoqi_min, self.naoqi_max = self.get_naoqi_reqs(pdict)
-        self.supported_langs = self.get_supported_languages(pdict)
-        self.description = self.get_description(pdict, lang)
-        self.behaviors = self.get_behs(pdict, lang)
-        self.services = self.get_servs(pdict)
 
     def __eq__(self, other):
         return self.uuid == other.uuid
@@ -145,6 +159,39 @@ class Package(object):
     def __lt__(self, other):
         return self.uuid < other.uuid
 
+    author = property(lambda self: self.pdict['author'])
+    channel = property(lambda self: self.pdict['channel'])
+    organization = property(lambda self: self.pdict['organization'])
+    date = property(lambda self: self.pdict['date'])
+    type_version = property(lambda self: self.pdict['typeVersion'])
+    installer = property(lambda self: self.pdict['installer'])
+    naoqi_min = property(lambda self: self.naoqi_reqs[0])
+    naoqi_max = property(lambda self: self.naoqi_reqs[1])
+
+    @lazy
+    def utterable_name(self):
+        return make_utterable(self.name)
+
+    @lazy
+    def naoqi_reqs(self):
+        return self.get_naoqi_reqs(self.pdict)
+
+    @lazy
+    def supported_langs(self):
+        return self.get_supported_languages(self.pdict)
+
+    @lazy
+    def description(self):
+        return self.get_description(self.pdict, self.lang)
+
+    @lazy
+    def behaviors(self):
+        return self.get_behs(self.pdict, self.lang)
+
+    @lazy
+    def services(self):
+        return self.get_servs(self.pdict)
+
     @staticmethod
     def get_name(pack, lang):
         """Return the localized name of the package or UUID as last resort."""
@@ -216,30 +263,28 @@ class Package(object):
 
 
 class Behavior(object):
+    __slots__ = ('package', 'bdict', 'lang', 'name', 'rel_path', 'launch_path',
+                 'nature', '_utterable_name', '_description', '_tags',
+                 '_trigger_sentences', '_loading_responses', '_launch_triggers')
 
     def __init__(self, package, bdict, lang):
         """Create an instance of a Behavior based on a dictionary of manifest
-        data.
+        data. Names, paths and nature are read up front, the other fields are
+        computed on first access.
         :param package: instance of the package class that contains the behavior
         :param bdict: dict of the behavior's manifest data
         :param lang: the language to use e.g. en_US
         """
         # Note: self.name will be the path if no name is provided
         self.package = package
+        self.bdict = bdict
+        self.lang = lang
         self.name = self.get_name(bdict, lang)
         self.rel_path = bdict['path']
         # e.g. tog-gun-4313f4/behavior_1 or tog-gun-4313f4/.
         self.launch_path = os.path.join(os.path.split(self.package.path)[1],
                                         self.rel_path)
-        self.utterable_name = self.get_utterable_name(self.name)
         self.nature = bdict['nature']
-        self.description = self.get_desciption(bdict, lang)
-        self.tags = self.get_tags(bdict, lang)
-        self.trigger_sentences = self.get_trigger_sentences(bdict, lang)
-        self.loading_responses = self.get_loading_responses(bdict, lang)
-        self.launch_triggers = self.get_launch_triggers(bdict)
-        self.categories = bdict['categories']
-        self.permisions = bdict['permissions']
 
     def __eq__(self, other):
         return self.launch_path == other.launch_path
@@ -258,6 +303,41 @@ class Behavior(object):
         beh['launch_path'] = self.launch_path
         return beh
 
+    def __getstate__(self):
+        # __dict__ is a method here, so pickle does not find the slots by itself
+        return dict((k, getattr(self, k)) for k in self.__slots__ if hasattr(self, k))
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
+
+    categories = property(lambda self: self.bdict['categories'])
+    permisions = property(lambda self: self.bdict['permissions'])
+
+    @lazy
+    def utterable_name(self):
+        return self.get_utterable_name(self.name)
+
+    @lazy
+    def description(self):
+        return self.get_desciption(self.bdict, self.lang)
+
+    @lazy
+    def tags(self):
+        return self.get_tags(self.bdict, self.lang)
+
+    @lazy
+    def trigger_sentences(self):
+        return self.get_trigger_sentences(self.bdict, self.lang)
+
+    @lazy
+    def loading_responses(self):
+        return self.get_loading_responses(self.bdict, self.lang)
+
+    @lazy
+    def launch_triggers(self):
+        return self.get_launch_triggers(self.bdict)
+
     @staticmethod
     def get_name(beh, lang):
         """Get behaviour name."""
@@ -318,28 +398,91 @@ class Behavior(object):
             return list()
 
 
-class Service():
+class Service(object):
+    __slots__ = ('name', 'auto_run', 'exec_start')
+
     def __init__(self, sdict):
         self.name = sdict['name']
         self.auto_run = bool(sdict['autoRun'])
         self.exec_start = sdict['execStart']
 
 
+class PackageSet(object):
+    """The packages installed on a robot, indexed once by uuid, localized name,
+    behavior launch path and service name."""
+
+    def __init__(self, packages):
+        self.packages = list(packages)
+        self.by_uuid = dict()
+        self.by_name = dict()
+        for p in self.packages:
+            self.by_uuid[p.uuid] = p
+            self.by_name.setdefault(p.name, p)
+
+    @lazy
+    def by_launch_path(self):
+        """Behaviors by launch path, built when first needed since it loads the
+        behaviors of every package."""
+        return dict((b.launch_path, b) for p in self.packages for b in p.behaviors)
+
+    @lazy
+    def by_service(self):
+        """Packages by the name of the services they declare."""
+        return dict((s.name, p) for p in self.packages for s in p.services)
+
+    def __iter__(self):
+        return iter(self.packages)
+
+    def __len__(self):
+        return len(self.packages)
+
+    def __contains__(self, key):
+        return key in self.by_uuid or key in self.by_name
+
+    def get(self, key):
+        """Return the package whose uuid or name is key, or None."""
+        return self.by_uuid.get(key) or self.by_name.get(key)
+
+    def package_keys(self):
+        """Completions for a package prompt: every uuid and name."""
+        return self.by_uuid.keys() + self.by_name.keys()
+
+    def launch_paths(self):
+        return self.by_launch_path.keys()
+
+    def service_names(self):
+        return self.by_service.keys()
+
+
+def fetch_packages(session, verb, api=None):
+    """Return the raw package dicts from PackageManager.
+    :param session: a connected qi session
+    :param api: 'packages2' or 'packages' if known, probed otherwise
+    :return: (name of the API used, list of package dicts)
+    """
+    pacman = session.service('PackageManager')
+    if api != 'packages':
+        try:
+            packs = pacman.packages2()
+            verb('Use pacman.packages2')
+            return 'packages2', packs
+        except AttributeError:
+            pass
+    packs = pacman.packages()
+    verb('Use pacman.packages')
+    return 'packages', packs
+
+
 def get_packages(lang, verb, session=None):
     """Return the installed packages as a list of package dicts
     :param pacman: the PackageManager service
     :param lang: the language e.g. en_US
     """
     if not session:
+        import qi
         session = qi.Session()
         session.connect('localhost')
-    pacman = session.service('PackageManager')
-    try:
-        packs = pacman.packages2()
-        verb('Use pacman.packages2')
-    except AttributeError:
-        packs = pacman.packages()
-        verb('Use pacman.packages')
+    api, packs = fetch_packages(session, verb)
     return [Package(d, lang) for d in packs]
 
 
@@ -368,6 +511,7 @@ def main():
     """Main fucntion for testing the classes"""
     # for testing
     from pprint import pprint
+    import qi
     sess = qi.Session('Raphael.local')
     # packages = [PACKAGE_1, PACKAGE_2]
     for pack in get_packages('en_US', sess):
@@ -0,0 +1,226 @@
+"""
+packager.py
+
+functions for building .pkg archives out of a project directory.
+"""
+
+import os
+import time
+import zlib
+import zipfile
+import itertools
+import xml.etree.ElementTree as ET
+import config
+import ignore
+
+# fixed timestamp for every archive entry so identical trees give identical zips
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# below this many files a process pool costs more than it saves
+MIN_PARALLEL_FILES = 64
+# already compressed formats, stored as is unless the compression field says otherwise
+STORED_EXTENSIONS = frozenset(['ogg', 'mp3', 'm4a', 'aac', 'flac', 'png', 'jpg', 'jpeg',
+                               'gif', 'webp', 'mp4', 'm4v', 'avi', 'mov', 'mkv', 'webm',
+                               'zip', 'gz', 'tgz', 'bz2', 'xz', '7z', 'pkg', 'whl', 'jar'])
+SAMPLE_SIZE = 64 * 1024  # bytes deflated to probe the other files
+MIN_SAMPLED_FILE = 4 * SAMPLE_SIZE  # smaller files are deflated without probing
+MIN_SAMPLE_GAIN = 0.95  # files whose sample deflates to more than this are stored
+# part of the cache key of builds: bump it when STORED_EXTENSIONS, the sampling
+# or anything else changes how the same files are packaged
+POLICY_VERSION = 1
+
+
+def get_package_uid(path):
+    """Get the UUID of the package locatated at path by parsing the manifest.
+    :params path: absolute path to the package directory.
+    :return: the UUID of package.
+    """
+    with open(os.path.join(path, 'manifest.xml'), 'r') as manifest:
+        xml = ET.fromstring(manifest.read())
+        try:
+            uid = xml.attrib['uuid']
+            return uid
+        except KeyError:
+            print 'no UUID found'
+            return None
+
+
+def walk_files(path, excluded=None):
+    """List the files under path in a stable order, leaving out those matched
+    by the .qidevignore rules of the project (see ignore.py). Excluded
+    directories are pruned from the walk, so their contents are never listed.
+    :param path: the root of the project directory
+    :param excluded: optional list, extended with (absolute path, bytes) of the
+    excluded files and directories; bytes is None for directories, which are
+    not walked
+    :return: list of (absolute path, '/' separated relative path) tuples
+    """
+    rules = ignore.Rules(path)
+    entries = list()
+    for root, dirs, files in os.walk(path):
+        rel_root = os.path.relpath(root, path).replace(os.sep, '/')
+        prefix = '' if rel_root == '.' else rel_root + '/'
+        kept = list()
+        for d in sorted(dirs):
+            if rules.excludes(prefix + d, is_dir=True):
+                if excluded is not None:
+                    excluded.append((os.path.join(root, d), None))
+            else:
+                kept.append(d)
+        dirs[:] = kept  # os.walk only descends into what is left in dirs
+        for f in sorted(files):
+            abs_path = os.path.join(root, f)
+            if rules.excludes(prefix + f):
+                if excluded is not None:
+                    excluded.append((abs_path, os.lstat(abs_path).st_size))
+            else:
+                entries.append((abs_path, prefix + f))
+    return entries
+
+
+def tree_size(path):
+    """Return the bytes of the files under path, e.g. of a directory pruned
+    from walk_files."""
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            size += os.lstat(os.path.join(root, f)).st_size
+    return size
+
+
+def build_jobs():
+    """Return the number of compression processes (config field build_jobs,
+    every core by default)."""
+    import multiprocessing
+    try:
+        return max(int(config.read_field('build_jobs')), 1)
+    except (TypeError, ValueError):
+        return multiprocessing.cpu_count()
+
+
+def extension(rel_path):
+    """Return the lower case extension of a file without its dot ('' if none)."""
+    return os.path.splitext(rel_path)[1][1:].lower()
+
+
+def compression_levels():
+    """Return the compression level of each extension set in the config field
+    compression (e.g. qidev config compression.wav 9): 0 stores files as is,
+    1 to 9 are deflate levels.
+    :return: dict of extension to level
+    """
+    levels = dict()
+    fields = config.read_field('compression')
+    if not isinstance(fields, dict):
+        return levels
+    for ext, level in fields.iteritems():
+        try:
+            levels[ext.lstrip('.').lower()] = min(max(int(level), 0), 9)
+        except (TypeError, ValueError):
+            pass
+    return levels
+
+
+def entry_level(rel_path, levels):
+    """Return the compression level of a file: the one set for its extension,
+    0 for STORED_EXTENSIONS, None to sample the file (see compress_entry)."""
+    ext = extension(rel_path)
+    if ext in levels:
+        return levels[ext]
+    return 0 if ext in STORED_EXTENSIONS else None
+
+
+def compressible(data):
+    """Guess whether deflating data is worth it by deflating SAMPLE_SIZE bytes
+    from its middle (past any header) at the fastest level."""
+    if len(data) < MIN_SAMPLED_FILE:
+        return True
+    start = (len(data) - SAMPLE_SIZE) // 2
+    sample = data[start:start + SAMPLE_SIZE]
+    return len(zlib.compress(sample, 1)) < MIN_SAMPLE_GAIN * len(sample)
+
+
+def compress_entry(entry):
+    """Compress one file the way zipfile.ZipFile.writestr does, so that
+    pre-compressed entries are byte-identical to a serial build. Files are
+    stored as is at level 0, when sampling finds them incompressible, or when
+    deflating does not make them smaller.
+    :param entry: (absolute path, relative path, level or None) tuple
+    :return: (relative path, mode, CRC, file size, compress type, compressed
+    data, seconds spent)
+    """
+    start = time.time()
+    abs_path, rel_path, level = entry
+    with open(abs_path, 'rb') as f:
+        data = f.read()
+    compress_type, compressed = zipfile.ZIP_STORED, data
+    if level is None and compressible(data):
+        level = zlib.Z_DEFAULT_COMPRESSION
+    if level:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = co.compress(data) + co.flush()
+        if len(deflated) < len(data):
+            compress_type, compressed = zipfile.ZIP_DEFLATED, deflated
+    return (rel_path, os.stat(abs_path).st_mode, zlib.crc32(data) & 0xffffffff,
+            len(data), compress_type, compressed, time.time() - start)
+
+
+def write_compressed(zipf, rel_path, mode, crc, file_size, compress_type, compressed):
+    """Append a pre-compressed (or stored) entry to an open ZipFile."""
+    info = zipfile.ZipInfo(rel_path, date_time=ZIP_DATE_TIME)
+    info.compress_type = compress_type
+    info.external_attr = (mode & 0xFFFF) << 16
+    info.file_size = file_size
+    info.compress_size = len(compressed)
+    info.CRC = crc
+    info.header_offset = zipf.fp.tell()
+    zip64 = file_size > zipfile.ZIP64_LIMIT or len(compressed) > zipfile.ZIP64_LIMIT
+    zipf.fp.write(info.FileHeader(zip64))
+    zipf.fp.write(compressed)
+    zipf.filelist.append(info)
+    zipf.NameToInfo[info.filename] = info
+
+
+def build(path, dest, jobs=None, excluded=None, stats=None, levels=None):
+    """Build a deterministic package of path at dest: entries are sorted and
+    carry a fixed timestamp. Files are compressed by a pool of jobs processes
+    and written to the archive in order, so the output does not depend on jobs.
+    :param path: the root of the project directory
+    :param dest: the path of the .pkg to write
+    :param jobs: number of compression processes, build_jobs() by default
+    :param excluded: optional list, extended as by walk_files
+    :param stats: optional dict, filled with extension: [files, bytes,
+    compressed bytes, seconds spent compressing]
+    :param levels: compression level by extension, compression_levels() by default
+    """
+    if levels is None:
+        levels = compression_levels()
+    entries = [(abs_path, rel_path, entry_level(rel_path, levels))
+               for abs_path, rel_path in walk_files(path, excluded)]
+    jobs = jobs or build_jobs()
+    pool = None
+    if jobs > 1 and len(entries) >= MIN_PARALLEL_FILES:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        compressed = pool.imap(compress_entry, entries, chunksize=8)
+    else:
+        compressed = itertools.imap(compress_entry, entries)
+    zipf = zipfile.ZipFile(dest, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+    try:
+        for entry in compressed:
+            write_compressed(zipf, *entry[:-1])
+            if stats is not None:
+                counts = stats.setdefault(extension(entry[0]), [0, 0, 0, 0.0])
+                counts[0] += 1
+                counts[1] += entry[3]
+                counts[2] += len(entry[5])
+                counts[3] += entry[6]
+    except:
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        zipf.close()
+        if pool:
+            pool.close()
+            pool.join()
+    return dest
@@ -12,6 +12,32 @@ import argparse
 running = True
 
 
+def add_group_argument(parser):
+    """--group, which adds the robots of groups/tags to --ip."""
+    parser.add_argument('-g', '--group', nargs='+', type=str, dest='group',
+                        help='also run on the robots of these groups or tags (see ' +
+                        '"qidev group")')
+
+
+def add_fleet_arguments(parser, timeout=None):
+    """Options of the commands that run on every robot of --ip at once.
+    :param timeout: default of --timeout in seconds, unbounded if None
+    """
+    parser.add_argument('-j', '--jobs', type=int, dest='jobs',
+                        help='number of robots handled at once with --ip (config ' +
+                        'field fleet_jobs, default 16)')
+    parser.add_argument('--connect-timeout', type=float, dest='connect_timeout',
+                        help='seconds to wait for each connection with --ip (config ' +
+                        'field fleet_connect_timeout, default 15)')
+    parser.add_argument('--timeout', type=float, dest='timeout', default=timeout,
+                        help='seconds to wait for the command on each robot with --ip ' +
+                        ('(default {:g})'.format(timeout) if timeout else
+                         '(unbounded by default)'))
+    parser.add_argument('--retries', type=int, dest='retries',
+                        help='extra connection attempts with --ip (config field ' +
+                        'fleet_retries, default 1)')
+
+
 def main():
     try:
         import handlers as hs
@@ -33,7 +59,36 @@ def main():
     connect_parser.add_argument('hostname', help='hostname or IP address of the robot', type=str)
 
     # ########################################################
-    subs.add_parser('info', help="what's up?")
+    group_parser = subs.add_parser('group', help='list, define or delete a named group of robots')
+    group_parser.add_argument('name', nargs='?', type=str,
+                              help='the group; without robots, list its robots')
+    group_parser.add_argument('robots', nargs='*', type=str,
+                              help='hostnames/IP addresses of the robots of the group')
+    group_parser.add_argument('-d', '--delete', action='store_true', dest='delete',
+                              help='delete the group')
+
+    # ########################################################
+    tag_parser = subs.add_parser('tag', help='show or set the tags of a robot')
+    tag_parser.add_argument('robot', type=str, help='hostname/IP address of the robot')
+    tag_parser.add_argument('tags', nargs='*', type=str,
+                            help='the tags of the robot, e.g. pepper-v2.9')
+    tag_parser.add_argument('-d', '--delete', action='store_true', dest='delete',
+                            help='remove every tag of the robot')
+
+    # ########################################################
+    agent_parser = subs.add_parser('agent',
+                                   help='background agent keeping robot connections warm')
+    agent_parser.add_argument('action', help='start, stop or status', type=str)
+
+    # ########################################################
+    info_parser = subs.add_parser('info', help="what's up?")
+    info_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
+                             help='specify hostname(es)/IP address(es)')
+    add_group_argument(info_parser)
+    info_parser.add_argument('--fleet', action='store_true', dest='fleet',
+                             help='query every known robot: the robots config field, ' +
+                             'and the robots of every group and tag')
+    add_fleet_arguments(info_parser, timeout=10)
 
     # ########################################################
     install_parser = subs.add_parser('install',
@@ -43,11 +98,27 @@ def main():
                                 type=str)
     install_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                                 help='specify hostname(es)/IP address(es)')
+    add_group_argument(install_parser)
+    install_parser.add_argument('--sync',
+                                help='push only the files that changed since the last ' +
+                                'install; reinstall if manifest.xml changed',
+                                action='store_true', dest='sync')
+    install_parser.add_argument('--build', type=str, dest='build',
+                                help='install a cached build (tree hash prefix, see ' +
+                                '"qidev cache") instead of packaging the project')
+    add_fleet_arguments(install_parser)
+
+    # ########################################################
+    cache_parser = subs.add_parser('cache', help='list cached package builds')
+    cache_parser.add_argument('uuid', nargs='?', type=str,
+                              help='only list the builds of this package')
 
     # ########################################################
     remove_parser = subs.add_parser('remove', help='remove a package from a robot')
     remove_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                                help='specify hostname(es)/IP address(es)')
+    add_group_argument(remove_parser)
+    add_fleet_arguments(remove_parser)
 
     # ########################################################
     show_parser = subs.add_parser('show', help='show the packages installed on a robot')
@@ -60,6 +131,9 @@ def main():
     mutex.add_argument('-a', '--active',
                        help='show active content (behaviors and services)',
                        action='store_true', dest='active')
+    show_parser.add_argument('-r', '--refresh',
+                             help='ask the robot instead of using the package inventory',
+                             action='store_true', dest='refresh')
 
     # ########################################################
     start_parser = subs.add_parser('start',
@@ -67,6 +141,7 @@ def main():
                                    'name on return')
     start_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                               help='specify hostname(es)/IP address(es)')
+    add_group_argument(start_parser)
     start_parser.add_argument('--id', '--name',
                               help='specify the name of the behavior/service/activity to start',
                               dest='name', type=str)
@@ -76,6 +151,7 @@ def main():
     start_parser.add_argument('-s', '--sm', '--service',
                               help='use ALServiceManager to start a declared service',
                               dest='service', action='store_true')
+    add_fleet_arguments(start_parser)
 
     # ########################################################
     stop_parser = subs.add_parser('stop',
@@ -83,6 +159,7 @@ def main():
                                   'name on return')
     stop_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                              help='specify hostname(es)/IP address(es)')
+    add_group_argument(stop_parser)
     stop_parser.add_argument('--id', '--name',
                              help='specify the name of the behavior/service/activity to stop',
                              dest='name', type=str)
@@ -92,6 +169,7 @@ def main():
     stop_parser.add_argument('-s', '--sm', '--service',
                              help='use ALServiceManager to stop a running service',
                              dest='service', action='store_true')
+    add_fleet_arguments(stop_parser)
 
     # ########################################################
     life_parser = subs.add_parser('life', help='toggle Autonomous Life state')
@@ -103,16 +181,22 @@ def main():
                             type=str)
     nao_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                             help='specify hostname(es)/IP address(es)')
+    add_group_argument(nao_parser)
+    add_fleet_arguments(nao_parser)
 
     # ########################################################
     reboot_parser = subs.add_parser('reboot', help='reboot the robot')
     reboot_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                                help='specify hostname(es)/IP address(es)')
+    add_group_argument(reboot_parser)
+    add_fleet_arguments(reboot_parser)
 
     # ########################################################
     shutdown_parser = subs.add_parser('shutdown', help='shutdown the robot')
     shutdown_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                                  help='specify hostname(es)/IP address(es)')
+    add_group_argument(shutdown_parser)
+    add_fleet_arguments(shutdown_parser)
 
     subs.add_parser('rest', help='put the robot to rest')
     subs.add_parser('wake', help='wake up the robot')
@@ -125,21 +209,55 @@ def main():
                                'volume by 10.', type=str)
     volume_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
                                help='specify hostname(es)/IP address(es)')
+    add_group_argument(volume_parser)
+    add_fleet_arguments(volume_parser)
 
     # #########################################################
     subs.add_parser('dialog', help='interactive dialog window')
 
     # #########################################################
     log_parser = subs.add_parser('log', help='view or copy naoqi logs')
+    log_parser.add_argument('action', nargs='?', choices=['ingest', 'query'],
+                            help='ingest: add the logs copied with --cp to the local ' +
+                            'archive; query: print the archived lines matching --ip, ' +
+                            '--level, --category, --grep, --since and --until')
     log_parser.add_argument('--cp', '--copy',
-                            help='copy tail-naoqi.log to local machine; configure log_path to ' +
-                            'change where this file is written.', action='store_true', dest='cp')
+                            help='copy what was added to tail-naoqi.log since the last ' +
+                            'copy to log_path/<robot>/ on the local machine; configure ' +
+                            'log_path to change where logs are written.',
+                            action='store_true', dest='cp')
+    log_parser.add_argument('--level', type=str, dest='level',
+                            help='only show this level and more severe ones: ' +
+                            'F, E, W, I, V or D (filtered on the robot)')
+    log_parser.add_argument('--grep', type=str, dest='grep',
+                            help='only show lines matching this extended regular ' +
+                            'expression (filtered on the robot)')
+    log_parser.add_argument('--since', type=str, dest='since',
+                            help='only show lines logged since TIME: epoch seconds, ' +
+                            '"15m", "2h", "1d" ago or "YYYY-MM-DD HH:MM" (filtered on the robot)')
+    log_parser.add_argument('--category', type=str, dest='category',
+                            help='only show categories matching this regular expression')
+    log_parser.add_argument('--until', type=str, dest='until',
+                            help='with query, only show lines logged before TIME')
+    log_parser.add_argument('--limit', type=int, dest='limit',
+                            help='with query, show at most this many lines')
+    log_parser.add_argument('--ip', nargs='*', type=str, dest='ip',
+                            help='specify hostname(es)/IP address(es); the logs of ' +
+                            'several robots are merged by timestamp')
+    add_group_argument(log_parser)
+    add_fleet_arguments(log_parser)
 
     args = parser.parse_args()
     handler = args.command + '_handler'
     if not args.verbose:
         sys.tracebacklimit = 0
-    getattr(hs, handler)(args)
+    try:
+        if getattr(args, 'group', None):
+            args.ip = hs.group_hosts(args.ip, args.group)
+        getattr(hs, handler)(args)
+    except ImportError as e:  # robot dependencies are imported by the handlers that use them
+        print('Missing Dependency: {}'.format(e))
+        sys.exit()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,63 @@
+"""
+sync.py
+
+functions for delta-syncing a project directory into an installed app.
+"""
+
+import hashlib
+import packager
+
+MANIFEST = 'manifest.xml'
+
+
+def file_digest(path, block_size=65536):
+    """Return the md5 hex digest of the file at path."""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            md5.update(block)
+            block = f.read(block_size)
+    return md5.hexdigest()
+
+
+def local_digests(path):
+    """Hash every file under path.
+    :param path: the root of the project directory
+    :return: dict of relative path ('/' separated) to md5 hex digest
+    """
+    return dict((rel_path, file_digest(abs_path))
+                for abs_path, rel_path in packager.walk_files(path))
+
+
+def parse_md5sum(file_like):
+    """Parse the output of md5sum into a dict of relative path to digest.
+    Paths reported by find are prefixed with './', which is stripped.
+    """
+    digests = dict()
+    for line in file_like:
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        digest, rel_path = line.split(None, 1)
+        rel_path = rel_path.lstrip('*')
+        if rel_path.startswith('./'):
+            rel_path = rel_path[2:]
+        digests[rel_path] = digest
+    return digests
+
+
+def diff(local, remote):
+    """Compare local and remote digests.
+    :return: (changed, deleted) where changed are the files to push and deleted
+    are the files to remove from the remote app.
+    """
+    changed = sorted(p for p, d in local.iteritems() if remote.get(p) != d)
+    deleted = sorted(p for p in remote if p not in local)
+    return changed, deleted
+
+
+def needs_reinstall(local, remote):
+    """A full reinstall through PackageManager is needed if the app is not
+    installed yet or if its manifest changed."""
+    return not remote or local.get(MANIFEST) != remote.get(MANIFEST)
@@ -0,0 +1,239 @@
+"""
+transfer.py
+
+functions for uploading packages to a robot over SFTP. Writes are pipelined
+(sent without waiting for each acknowledgement) in requests of transfer_chunk
+bytes, as many as the receive window of the robot allows, and the source file
+is memory-mapped rather than read into Python buffers.
+
+Uploads are resumable: the package is written to <remote path>.part, and every
+SEGMENT bytes the offset the robot confirmed is recorded in
+<cache_path>/uploads/<hostname>.json along with the SHA-256 of the package.
+After a dropped connection the upload reconnects and continues from that
+offset. The SHA-256 of the .part file is checked on the robot before it is
+renamed into place.
+"""
+
+import os
+import json
+import mmap
+import time
+import socket
+import hashlib
+import tempfile
+import config
+import cache
+
+# bytes per SFTP write request; sftp-server (OpenSSH) accepts up to 256 KiB
+DEFAULT_CHUNK = 64 * 1024
+MAX_CHUNK = 255 * 1024
+SEGMENT = 4 * 1024 * 1024  # bytes confirmed and recorded at a time
+DEFAULT_RETRIES = 5  # reconnections before giving up
+STALL_TIMEOUT = 30  # seconds without progress before the connection is dropped
+PART = '.part'
+
+
+class Interrupted(RuntimeError):
+    """An upload attempt failed in a way a new attempt may fix."""
+    pass
+
+
+class ChecksumError(Interrupted):
+    pass
+
+
+def chunk_size():
+    """Return the size of SFTP write requests (config field transfer_chunk)."""
+    try:
+        return min(max(int(config.read_field('transfer_chunk')), 4096), MAX_CHUNK)
+    except (TypeError, ValueError):
+        return DEFAULT_CHUNK
+
+
+def retries():
+    """Return the number of reconnections of an upload (config field upload_retries)."""
+    try:
+        return max(int(config.read_field('upload_retries')), 0)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRIES
+
+
+def file_sha256(path, block_size=1048576):
+    """Return the SHA-256 hex digest of the file at path."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha.update(block)
+            block = f.read(block_size)
+    return sha.hexdigest()
+
+
+def progress_path(hostname):
+    return os.path.join(cache.cache_path(), 'uploads', hostname + '.json')
+
+
+def read_progress(hostname):
+    """Return the recorded uploads to hostname: a dict of remote path to
+    {'sha256': digest of the package, 'offset': confirmed bytes}."""
+    try:
+        with open(progress_path(hostname), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+
+def write_progress(hostname, records):
+    path = progress_path(hostname)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(records, f)
+    os.rename(tmp, path)
+
+
+def open_sftp(transport):
+    """Open an SFTP client on a paramiko transport that gives up on a stalled
+    connection."""
+    import paramiko
+    channel = transport.open_session()
+    channel.settimeout(STALL_TIMEOUT)
+    channel.invoke_subsystem('sftp')
+    return paramiko.SFTPClient(channel)
+
+
+def send(sftp, local_path, remote_path, offset=0, chunk=None, progress=None,
+         confirmed=None):
+    """Write the file at local_path from offset on to remote_path, which must be
+    offset bytes long.
+    :param chunk: bytes per write request, chunk_size() by default
+    :param progress: function of (bytes sent, total bytes), called after each chunk
+    :param confirmed: function of the offset the robot confirmed, called every SEGMENT
+    :return: the number of bytes sent
+    """
+    chunk = chunk or chunk_size()
+    size = os.path.getsize(local_path)
+    if not size:
+        sftp.open(remote_path, 'wb').close()
+        return 0
+    with open(local_path, 'rb') as f:
+        view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for segment in xrange(offset, size, SEGMENT):
+            end = min(segment + SEGMENT, size)
+            # not 'ab': paramiko asks the size of files opened for appending
+            remote = sftp.open(remote_path, 'r+b' if segment else 'wb', bufsize=0)
+            remote.seek(segment)
+            # paramiko splits writes into requests of at most MAX_REQUEST_SIZE
+            remote.MAX_REQUEST_SIZE = chunk
+            remote.set_pipelined(True)
+            try:
+                for start in xrange(segment, end, chunk):
+                    remote.write(view[start:min(start + chunk, end)])
+                    if progress:
+                        progress(min(start + chunk, end), size)
+            finally:
+                remote.close()  # waits for the acknowledgements of the segment
+            written = sftp.stat(remote_path).st_size
+            if written != end:
+                raise Interrupted('{} is {} bytes long, expected {}'.format(
+                    remote_path, written, end))
+            if confirmed:
+                confirmed(end)
+    finally:
+        view.close()
+    return size - offset
+
+
+def rename(sftp, src, dst):
+    """Rename src to dst over SFTP, replacing dst if it exists."""
+    if hasattr(sftp, 'posix_rename'):  # paramiko >= 2.2, atomic
+        sftp.posix_rename(src, dst)
+        return
+    # SSH_FXP_RENAME fails if dst exists
+    try:
+        sftp.remove(dst)
+    except IOError:
+        pass
+    sftp.rename(src, dst)
+
+
+def remote_sha256(transport, remote_path):
+    """Return the SHA-256 hex digest of remote_path, computed on the robot."""
+    import pipes
+    channel = transport.open_session()
+    try:
+        channel.settimeout(STALL_TIMEOUT)
+        channel.exec_command('sha256sum ' + pipes.quote(remote_path))
+        output = channel.makefile('r').read()
+        if channel.recv_exit_status() != 0 or not output:
+            raise Interrupted('could not hash {} on the robot'.format(remote_path))
+        return output.split()[0]
+    finally:
+        channel.close()
+
+
+def upload(hostname, connect, local_path, remote_path, chunk=None, progress=None,
+           max_retries=None):
+    """Upload the file at local_path to remote_path, resuming an interrupted
+    upload of the same file and reconnecting when the connection drops. The
+    file is renamed to remote_path once its SHA-256 matched on the robot.
+    :param hostname: the robot, under which progress is recorded
+    :param connect: function returning an active paramiko Transport, opening a
+    new SSH connection if the previous one was closed
+    :param chunk: bytes per write request, chunk_size() by default
+    :param progress: function of (bytes sent, total bytes)
+    :param max_retries: reconnections before giving up, retries() by default
+    :return: (bytes sent, seconds)
+    """
+    import paramiko
+    if max_retries is None:
+        max_retries = retries()
+    digest = file_sha256(local_path)
+    part = remote_path + PART
+    records = read_progress(hostname)
+    start, sent, attempt = time.time(), 0, 0
+
+    def confirmed(offset):
+        records[remote_path]['offset'] = offset
+        write_progress(hostname, records)
+
+    while True:
+        transport = None
+        try:
+            try:
+                transport = connect()
+            except RuntimeError as e:  # the robot is unreachable for now
+                raise Interrupted(str(e))
+            sftp = open_sftp(transport)
+            try:
+                offset = 0
+                record = records.get(remote_path)
+                if record and record['sha256'] == digest:
+                    try:
+                        offset = min(sftp.stat(part).st_size, record['offset'])
+                        sftp.truncate(part, offset)  # drop unconfirmed bytes
+                    except IOError:  # no .part left on the robot
+                        offset = 0
+                records[remote_path] = {'sha256': digest, 'offset': offset}
+                write_progress(hostname, records)
+                sent += send(sftp, local_path, part, offset, chunk, progress, confirmed)
+                if remote_sha256(transport, part) != digest:
+                    sftp.remove(part)
+                    del records[remote_path]
+                    raise ChecksumError('{}: checksum mismatch after upload'.format(part))
+                rename(sftp, part, remote_path)
+                del records[remote_path]
+                write_progress(hostname, records)
+                return sent, time.time() - start
+            finally:
+                sftp.close()
+        except (Interrupted, EOFError, socket.error, paramiko.SSHException) as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise RuntimeError('upload of {} to {} failed after {} attempts: {}'.format(
+                    os.path.basename(local_path), hostname, attempt, e))
+            if transport:
+                transport.close()  # connect() opens a new connection
+            time.sleep(min(2 ** attempt, 30))